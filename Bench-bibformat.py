@@ -0,0 +1,351 @@
+#!/usr/bin/python
+
+#Benchmark of the format checks of bibformat (fix_identifier, extract_identifiers, check digit functions)
+#on a generated corpus, to detect performance regressions when the regular expressions or check digit functions are changed
+#Corpora (generated with a fixed seed, so that runs are comparable):
+# - clean: identifiers alone, as stored in a database
+# - noisy: identifiers with prefixes, URLs, extra spaces and punctuation, surrounding text, 20% wrong check digits
+# - html: large web pages with identifiers in links and text
+# - adversarial: inputs built to make the regular expressions backtrack (long digit runs, long DOI-like tokens...)
+#Reported: throughput per identifier type (calls/s and MB/s), worst time for a single input,
+#the batch function fix_identifiers (list and pandas Series) compared to one fix_identifier call per string,
+#for the adversarial inputs the growth of the time when the input is 4 times longer (about 4 for linear behaviour),
+#and for the DOI filter (see bibformat.build_doi_filter) the build, load and query times and the observed false positive rate
+#Examples:
+#   python Bench-bibformat.py
+#   python Bench-bibformat.py --scale 5 --types doi,isbn --profile
+#   python Bench-bibformat.py --save baseline.json          (before a change)
+#   python Bench-bibformat.py --baseline baseline.json      (after: exit code 1 if something is more than 25% slower)
+
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import tempfile
+
+import bibformat
+
+TYPES = ['doi', 'isbn', 'issn', 'pmid', 'scopusid', 'ut']
+
+### CORPUS ###
+
+def gen_isbn(rnd):
+    if rnd.random() < 0.3:
+        core = ''.join(rnd.choice('0123456789') for i in range(9))
+        checksum = (11 - sum((10-i)*int(x) for i,x in enumerate(core)) % 11) % 11
+        isbn = core + ('X' if checksum == 10 else str(checksum))
+        return isbn[0] + '-' + isbn[1:5] + '-' + isbn[5:9] + '-' + isbn[9]
+    return bibformat.isbn10_to_isbn13(''.join(rnd.choice('0123456789') for i in range(9)) + '0')
+
+def gen_issn(rnd):
+    return bibformat.int_to_issn(rnd.randrange(10**7))
+
+def gen_doi(rnd):
+    prefix = '10.' + str(rnd.randrange(1000, 99999))
+    suffix = rnd.choice(['j.cell.' + str(rnd.randrange(10**6)), 'S' + str(rnd.randrange(10**15)).zfill(15), 'ijc.' + str(rnd.randrange(10**5)),
+                         'JOSA.18.' + str(rnd.randrange(1000)).zfill(6), '978-1-137-' + str(rnd.randrange(10**5)) + '-6',
+                         'abc(' + str(rnd.randrange(100)) + ')' + str(rnd.randrange(10**4)) + '-x'])
+    return prefix + rnd.choice(['/', '/', '/', '%2F']) + suffix
+
+def gen_pmid(rnd):
+    return str(rnd.randrange(1, 40000000))
+
+def gen_scopusid(rnd):
+    return '2-s2.0-' + str(rnd.randrange(10**10, 10**11))
+
+def gen_ut(rnd):
+    if rnd.random() < 0.1:
+        return 'A19' + str(rnd.randrange(70, 100)) + ''.join(rnd.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789') for i in range(5)) + str(rnd.randrange(10**5)).zfill(5)
+    return '00' + str(rnd.randrange(10**13)).zfill(13)
+
+GENERATORS = {'doi': gen_doi, 'isbn': gen_isbn, 'issn': gen_issn, 'pmid': gen_pmid, 'scopusid': gen_scopusid, 'ut': gen_ut}
+
+LABELS = {'doi': ['doi:', 'https://doi.org/', 'http://dx.doi.org/', 'DOI '], 'isbn': ['ISBN ', 'ISBN: ', 'isbn13 '], 'issn': ['ISSN ', 'eISSN: '],
+          'pmid': ['PMID: ', 'PubMed ID ', 'https://pubmed.ncbi.nlm.nih.gov/'], 'scopusid': ['eid=', 'EID: '], 'ut': ['WOS:', 'UT ']}
+
+WORDS = "the of and in a study analysis results journal vol no pp 2019 proceedings conference data method effect (2021) et al. [online] available".split()
+
+def corrupt(rnd, the_id):
+    #Wrong check digit (or last digit) in place
+    digits = [i for i,c in enumerate(the_id) if c.isdigit()]
+    i = digits[-1]
+    return the_id[:i] + str((int(the_id[i]) + rnd.randrange(1, 10)) % 10) + the_id[i+1:]
+
+def gen_noisy(rnd, idtype):
+    the_id = GENERATORS[idtype](rnd)
+    if idtype in ['isbn', 'issn'] and rnd.random() < 0.2:
+        the_id = corrupt(rnd, the_id)
+    if idtype == 'isbn' and rnd.random() < 0.3:
+        the_id = the_id.replace('-', ' ')
+    text = rnd.choice(LABELS[idtype]) + the_id + rnd.choice(['', '.', ',', ';', ' ', ')', '  '])
+    before = ' '.join(rnd.choice(WORDS) for i in range(rnd.randrange(0, 12)))
+    after = ' '.join(rnd.choice(WORDS) for i in range(rnd.randrange(0, 12)))
+    return (before + ' ' + text + ' ' + after).strip()
+
+#with_ids=False: page without any digit (filler for the search of a single identifier placed at its end)
+def gen_html(rnd, size, with_ids=True):
+    parts = ['<!DOCTYPE html><html><head><title>References</title><script>var config = {"a": "b", "c": ["d","e"]};</script></head><body>']
+    length = len(parts[0])
+    words = WORDS if with_ids else [w for w in WORDS if not any(c.isdigit() for c in w)]
+    while length < size:
+        if not with_ids:
+            chunk = '<p class="text">' + ' '.join(rnd.choice(words) for i in range(30)) + '</p>\n'
+            if rnd.random() < 0.05:
+                chunk += '<div style="width:auto" data-x="' + ''.join(rnd.choice('abcdef%/-') for i in range(200)) + '"></div>\n'
+            parts.append(chunk)
+            length += len(chunk)
+            continue
+        idtype = rnd.choice(TYPES)
+        the_id = GENERATORS[idtype](rnd)
+        if idtype == 'doi':
+            chunk = '<li class="ref"><a href="https://doi.org/' + the_id + '" target="_blank">' + the_id + '</a> ' + ' '.join(rnd.choice(WORDS) for i in range(20)) + '</li>\n'
+        else:
+            chunk = '<tr><td>' + ' '.join(rnd.choice(WORDS) for i in range(10)) + '</td><td>' + rnd.choice(LABELS[idtype]) + the_id + '</td></tr>\n'
+        if rnd.random() < 0.05:
+            chunk += '<div style="width:100%;height:20px" data-x="' + ''.join(rnd.choice('abcdef0123456789') for i in range(200)) + '"></div>\n'
+        parts.append(chunk)
+        length += len(chunk)
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+#Adversarial families: function of a length n returning an input string
+ADVERSARIAL = {
+    'digit run': lambda n: '1' * n,
+    'spaced digits': lambda n: '1 ' * (n//2),
+    'dashed digits': lambda n: '1-' * (n//2),
+    'digit and spaces': lambda n: ('1' + ' ' * 50) * (n//51),
+    'doi prefix, no slash': lambda n: '10.' + '1' * n,
+    'repeated doi prefixes': lambda n: '10.1234 ' * (n//8),
+    'long doi suffix': lambda n: '10.1234/' + 'a' * n + ' ',
+    'doi suffix of escapes': lambda n: '10.1234/' + '%2' * (n//2),
+    'doi suffix of stop chars': lambda n: ('10.1234/' + '"#?%' * 4) * (n//24),
+    'long token': lambda n: 'x' * n,
+    'ut-like zeros': lambda n: '0' * n,
+    'eid prefixes': lambda n: '2-s2.0-123 ' * (n//11),
+    'issn-like': lambda n: '1234-567 ' * (n//9),
+}
+
+
+### MEASUREMENTS ###
+
+def throughput(strings, idtype, checksum=True):
+    fix = bibformat.fix_identifier
+    t0 = time.perf_counter()
+    found = 0
+    for s in strings:
+        if fix(s, idtype, checksum=checksum):
+            found += 1
+    elapsed = time.perf_counter() - t0
+    nbytes = sum(len(s) for s in strings)
+    return {"calls": len(strings), "found": found, "seconds": elapsed, "calls_per_s": len(strings)/elapsed if elapsed else 0, "mb_per_s": nbytes/elapsed/1e6 if elapsed else 0}
+
+def worst_case(strings, idtype):
+    fix = bibformat.fix_identifier
+    clock = time.perf_counter
+    worst = 0.0
+    worst_input = ""
+    for s in strings:
+        t0 = clock()
+        fix(s, idtype)
+        t = clock() - t0
+        if t > worst:
+            worst = t
+            worst_input = s
+    return worst, worst_input
+
+def timed(function, *args):
+    t0 = time.perf_counter()
+    res = function(*args)
+    return time.perf_counter() - t0, res
+
+def run(args):
+    rnd = random.Random(args.seed)
+    types = args.types.split(',') if args.types else TYPES
+    n = int(20000 * args.scale)
+    results = {"clean": {}, "noisy": {}, "html": {}, "adversarial": {}, "checkdigit": {}, "batch": {}, "doifilter": {}}
+    out = print if not args.quiet else (lambda *a, **k: None)
+
+    out("### Throughput per type (fix_identifier, " + str(n) + " inputs per corpus) ###")
+    out("%-9s %-6s %10s %8s %9s %14s" % ("type", "corpus", "calls/s", "MB/s", "found", "worst call ms"))
+    for idtype in types:
+        for corpus in ['clean', 'noisy']:
+            if corpus == 'clean':
+                strings = [GENERATORS[idtype](rnd) for i in range(n)]
+            else:
+                strings = [gen_noisy(rnd, idtype) for i in range(n)]
+            res = throughput(strings, idtype)
+            worst, worst_input = worst_case(strings, idtype)
+            res["worst_s"] = worst
+            res["worst_input"] = worst_input[:200]
+            results[corpus][idtype] = res
+            out("%-9s %-6s %10.0f %8.2f %9d %14.3f" % (idtype, corpus, res["calls_per_s"], res["mb_per_s"], res["found"], worst*1000))
+
+    out("\n### Large HTML pages ###")
+    pages = [gen_html(rnd, int(1e6 * args.scale)) for i in range(3)]
+    nbytes = sum(len(p) for p in pages)
+    t, found = timed(lambda: sum(1 for p in pages for m in bibformat.extract_identifiers(p)))
+    results["html"]["extract_identifiers"] = {"seconds": t, "mb_per_s": nbytes/t/1e6, "found": found}
+    out("extract_identifiers (all types): %.2f MB/s, %d identifiers" % (nbytes/t/1e6, found))
+    filler = gen_html(rnd, int(1e6 * args.scale), with_ids=False)
+    for idtype in types:
+        #fix_identifier stops at the first match: the identifier is placed at the end of a page without digits, so that the whole page is searched
+        page = filler + ' ' + rnd.choice(LABELS[idtype]) + GENERATORS[idtype](rnd) + ' '
+        t, res = timed(lambda: [bibformat.fix_identifier(page, idtype) for i in range(3)])
+        results["html"][idtype] = {"seconds": t, "mb_per_s": 3*len(page)/t/1e6}
+        t, res = timed(lambda: [m for p in pages for m in bibformat.extract_identifiers(p, [idtype])])
+        results["html"][idtype]["extract_mb_per_s"] = nbytes/t/1e6
+        out("%-9s fix_identifier %8.2f MB/s, extract_identifiers %8.2f MB/s" % (idtype, results["html"][idtype]["mb_per_s"], results["html"][idtype]["extract_mb_per_s"]))
+
+    out("\n### Adversarial inputs (worst type; growth = time(4n)/time(n), about 4 if linear) ###")
+    size = int(20000 * args.scale)
+    out("%-26s %-9s %12s %12s %8s" % ("input", "type", "n ms", "4n ms", "growth"))
+    for name, make in ADVERSARIAL.items():
+        small = make(size)
+        large = make(4*size)
+        worst = None
+        for idtype in types:
+            t_small = min(timed(bibformat.fix_identifier, small, idtype)[0] for i in range(3))
+            t_large = min(timed(bibformat.fix_identifier, large, idtype)[0] for i in range(3))
+            if worst is None or t_large > worst[2]:
+                worst = (idtype, t_small, t_large)
+        t_extract = min(timed(lambda: list(bibformat.extract_identifiers(large, types)))[0] for i in range(3))
+        idtype, t_small, t_large = worst
+        growth = t_large/t_small if t_small > 0 else 0
+        results["adversarial"][name] = {"type": idtype, "seconds_n": t_small, "seconds_4n": t_large, "growth": growth, "extract_seconds_4n": t_extract}
+        flag = "  <- superlinear" if growth > 8 and t_large > 0.001 else ""
+        out("%-26s %-9s %12.3f %12.3f %8.1f%s" % (name, idtype, t_small*1000, t_large*1000, growth, flag))
+
+    out("\n### Batch (fix_identifiers) vs per call (fix_identifier), " + str(n) + " noisy inputs per type ###")
+    try:
+        import pandas
+    except ImportError:
+        pandas = None
+        out("(pandas not installed: Series input not measured)")
+    out("%-9s %14s %14s %14s %8s" % ("type", "per call/s", "list/s", "Series/s", "speedup"))
+    for idtype in types:
+        strings = [gen_noisy(rnd, idtype) for i in range(n)]
+        t_call, expected = timed(lambda: [bibformat.fix_identifier(s, idtype) for s in strings])
+        t_list, res = timed(bibformat.fix_identifiers, strings, idtype)
+        res_batch = {"per_call_calls_per_s": n/t_call, "list_calls_per_s": n/t_list, "same_results": res == expected}
+        if pandas is not None:
+            series = pandas.Series(strings)
+            t_series, res = timed(bibformat.fix_identifiers, series, idtype)
+            res_batch["series_calls_per_s"] = n/t_series
+            res_batch["same_results"] = res_batch["same_results"] and list(res) == expected
+        results["batch"][idtype] = res_batch
+        flag = "" if res_batch["same_results"] else "  <- different results"
+        out("%-9s %14.0f %14.0f %14s %8.2f%s" % (idtype, n/t_call, n/t_list, "%.0f" % res_batch["series_calls_per_s"] if "series_calls_per_s" in res_batch else "-", t_call/t_list, flag))
+
+    out("\n### Check digit functions ###")
+    isbns = [gen_isbn(rnd) for i in range(n)]
+    issns = [gen_issn(rnd) for i in range(n)]
+    for name, function, strings in [("isbn_checkdigit", bibformat.isbn_checkdigit, isbns), ("issn_checkdigit", bibformat.issn_checkdigit, issns)]:
+        t, res = timed(lambda: [function(s) for s in strings])
+        results["checkdigit"][name] = {"calls_per_s": n/t}
+        out("%-18s %12.0f calls/s" % (name, n/t))
+    try:
+        import numpy
+        for name, function, strings in [("isbn_checkdigits", bibformat.isbn_checkdigits, isbns), ("issn_checkdigits", bibformat.issn_checkdigits, issns)]:
+            t, res = timed(function, strings)
+            results["checkdigit"][name] = {"calls_per_s": n/t}
+            out("%-18s %12.0f calls/s" % (name, n/t))
+    except ImportError:
+        out("(numpy not installed: vectorized check digits not measured)")
+
+    if 'doi' in types:
+        out("\n### DOI filter (" + str(5*n) + " DOIs, error_rate=0.01) ###")
+        members = [GENERATORS['doi'](rnd) for i in range(5*n)]
+        others = [GENERATORS['doi'](rnd) for i in range(n)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            doisfile = os.path.join(tmpdir, 'dois.txt')
+            filterfile = os.path.join(tmpdir, 'dois.bloom')
+            with open(doisfile, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(members) + '\n')
+            t, doifilter = timed(bibformat.build_doi_filter, doisfile, None, 0.01, filterfile)
+            results["doifilter"]["build"] = {"dois_per_s": len(members)/t, "bytes": os.path.getsize(filterfile)}
+            out("%-18s %12.0f DOIs/s, %d bytes" % ("build_doi_filter", len(members)/t, os.path.getsize(filterfile)))
+            t, loaded = timed(bibformat.DOIFilter, 1, 0.01, filterfile)
+            results["doifilter"]["load"] = {"seconds": t}
+            out("%-18s %12.3f ms" % ("load (mmap)", t*1000))
+            t, res = timed(loaded.contains_many, members[:n] + others)
+            falsepositives = sum(res[n:])
+            results["doifilter"]["query"] = {"queries_per_s": 2*n/t, "false_positive_rate": falsepositives/n}
+            out("%-18s %12.0f queries/s, false positive rate %.4f" % ("contains_many", 2*n/t, falsepositives/n))
+            #(the memory map is closed so that the temporary directory can be removed)
+            loaded.bits.release()
+            loaded.mmap.close()
+    return results
+
+#Throughput figures compared to a saved run: returns the list of measurements slower than the baseline by more than tolerance
+def compare(results, baseline, tolerance):
+    regressions = []
+    for corpus in ['clean', 'noisy']:
+        for idtype, res in results[corpus].items():
+            old = baseline.get(corpus, {}).get(idtype)
+            if old and res["calls_per_s"] < old["calls_per_s"] * (1 - tolerance):
+                regressions.append(corpus + " " + idtype + ": " + str(round(old["calls_per_s"])) + " -> " + str(round(res["calls_per_s"])) + " calls/s")
+    for key, res in results["html"].items():
+        old = baseline.get("html", {}).get(key)
+        if old and res["mb_per_s"] < old["mb_per_s"] * (1 - tolerance):
+            regressions.append("html " + key + ": " + str(round(old["mb_per_s"], 2)) + " -> " + str(round(res["mb_per_s"], 2)) + " MB/s")
+    for name, res in results["adversarial"].items():
+        old = baseline.get("adversarial", {}).get(name)
+        #(times of a few milliseconds are too noisy to be compared)
+        if old and res["seconds_4n"] > old["seconds_4n"] * (1 + tolerance) and res["seconds_4n"] > 0.005:
+            regressions.append("adversarial " + name + ": " + str(round(old["seconds_4n"]*1000, 3)) + " -> " + str(round(res["seconds_4n"]*1000, 3)) + " ms")
+    for name, res in results["checkdigit"].items():
+        old = baseline.get("checkdigit", {}).get(name)
+        if old and res["calls_per_s"] < old["calls_per_s"] * (1 - tolerance):
+            regressions.append(name + ": " + str(round(old["calls_per_s"])) + " -> " + str(round(res["calls_per_s"])) + " calls/s")
+    for idtype, res in results["batch"].items():
+        for key in ["per_call_calls_per_s", "list_calls_per_s", "series_calls_per_s"]:
+            old = baseline.get("batch", {}).get(idtype, {}).get(key)
+            if old and key in res and res[key] < old * (1 - tolerance):
+                regressions.append("batch " + idtype + " " + key + ": " + str(round(old)) + " -> " + str(round(res[key])) + " calls/s")
+    old = baseline.get("doifilter", {})
+    res = results.get("doifilter", {})
+    for name, key, unit in [("build", "dois_per_s", "DOIs/s"), ("query", "queries_per_s", "queries/s")]:
+        if name in old and name in res and res[name][key] < old[name][key] * (1 - tolerance):
+            regressions.append("doifilter " + name + ": " + str(round(old[name][key])) + " -> " + str(round(res[name][key])) + " " + unit)
+    if "load" in old and "load" in res and res["load"]["seconds"] > old["load"]["seconds"] * (1 + tolerance) and res["load"]["seconds"] > 0.005:
+        regressions.append("doifilter load: " + str(round(old["load"]["seconds"]*1000, 3)) + " -> " + str(round(res["load"]["seconds"]*1000, 3)) + " ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the format checks of bibformat')
+    parser.add_argument('--scale', type=float, default=1.0, help='size of the corpus (1: 20000 inputs per type and corpus, 1 MB HTML pages)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--types', default='', help='comma-separated identifier types (default: all)')
+    parser.add_argument('--profile', action='store_true', help='also report the time spent in regular expressions vs check digits (bibformat.enable_profiling)')
+    parser.add_argument('--save', default='', help='write the results to this JSON file')
+    parser.add_argument('--baseline', default='', help='compare with the results saved in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='relative slowdown reported as a regression')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+    if args.profile:
+        bibformat.enable_profiling()
+    results = run(args)
+    if args.profile:
+        print("\n### Profile of fix_identifier ###")
+        print(bibformat.profiling_report())
+        results["profile"] = bibformat.PROFILER.stats()
+        bibformat.disable_profiling()
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        print("\n### Comparison with " + args.baseline + " ###")
+        for r in regressions:
+            print("SLOWER: " + r)
+        if not regressions:
+            print("No regression above " + str(int(args.tolerance*100)) + "%")
+        return int(bool(regressions))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -163,3 +163,76 @@ print(Result13)
 #WARNING: this doesn't seem to work anymore?
 Result14 = bibapi.get_dates_sciencedirect(idtype='pubmed_id', idval='24662697')
 print(Result14)
+
+
+##################
+### RESILIENCE ###
+# Opt-in layer used by all BibAPI calls and by the online checks of bibformat:
+# deadline budget per call, hedged duplicate request after the p95 latency of the host, per-host circuit breakers
+
+bibapi.enable_resilience(deadline=10, failure_threshold=5, reset_timeout=30)
+Result15 = bibapi.doi_handle('10.1002/ijc.11382')
+#Circuit state (closed/open/half_open), failures, hedged requests, p95 latency per host
+print(bibapi.resilience_metrics())
+bibapi.disable_resilience()
+
+
+##############
+### LIBRIS ###
+
+## Display documentation URL
+MyClient.doc('libris')
+
+## bibapi.libris_isbn_search: search Libris for one ISBN
+Result16 = bibapi.libris_isbn_search('9780141040349')
+print(Result16["xsearch"]["records"])
+
+## bibapi.libris_isbn_bulk_search: search Libris for many ISBNs with a few packed queries (ISBN:a OR ISBN:b OR ...)
+#Returns for each ISBN the list of matching records (matched on ISBN-10 or ISBN-13), None if the query failed
+Result17 = bibapi.libris_isbn_bulk_search(['978-0-14-104034-9', '91-7501-031-3', '012-3-45-678901-2'], workers=4)
+print({isbn: len(records) for isbn, records in Result17.items() if records is not None})
+
+
+#################
+### SCHEDULER ###
+# Opt-in layer under all BibAPI service methods: per-service limits (calls in flight, calls per second),
+# priority classes (interactive calls jump ahead of queued batch calls) and latency SLO tracking
+
+bibapi.enable_scheduler(limits={"openalex": 4}, rates={"openalex": 10}, slo={"interactive": 2.0, "batch": None})
+#Calls are interactive by default; a harvest marks its calls as batch
+with bibapi.scheduling_priority("batch"):
+    Result18 = bibapi.openalex_works({"doi": "10.1002/ijc.11382"}, {})
+Result19 = bibapi.doi_handle('10.1002/ijc.11382')
+#Calls, queue wait and latency quantiles, SLO violations per service and priority class
+print(bibapi.scheduler_metrics())
+bibapi.disable_scheduler()
+
+
+######################
+### RESPONSE CACHE ###
+# Opt-in persistent cache of GET responses with their validators (ETag, Last-Modified):
+# responses are revalidated with If-None-Match/If-Modified-Since, a "304 Not Modified" answer is served from the cache without downloading the body
+# ttl: seconds during which a response is served without any request (0: always revalidated)
+
+bibapi.enable_response_cache(services=["ror", "doaj", "openapc"], ttl=0)
+Result20 = MyClient.ror(path="organizations/026vcq606")
+Result20 = MyClient.ror(path="organizations/026vcq606")
+#True if the last response was served from the cache (after a 304 answer or within the ttl)
+print(getattr(MyClient.lastresponse, "from_cache", False))
+#Requests, revalidations, 304 answers, bytes saved and downloaded
+print(bibapi.response_cache_metrics())
+bibapi.disable_response_cache()
+
+
+###############
+### OVERTON ###
+# Requires an Overton API key in the environment variable OVERTON_KEY
+
+## bibapi.overton_policy_citations: number of policy documents citing a DOI and number of distinct sources
+Result21 = bibapi.overton_policy_citations('10.1002/ijc.11382')
+print(Result21)
+
+## bibapi.overton_policy_citations_bulk: the same for many DOIs, at most 4 requests at a time
+#Returns for each DOI the tuple (policy documents, distinct sources), None if its request failed
+Result22 = bibapi.overton_policy_citations_bulk(['10.1002/ijc.11382', '10.1364/JOSA.18.000337'], workers=4)
+print(Result22)
@@ -38,6 +38,10 @@ bibformat.fix_doi("The DOI 10.1364/JOSA.18.000337 can be extracted from this str
 #Can be used to find a DOI on a webpage
 req1 = requests.get('https://kth.diva-portal.org/smash/record.jsf?pid=diva2:1414460')
 bibformat.fix_doi(req1.text)
+#The same without downloading the whole page: the body is scanned as it is received and the download stops at the first DOI
+bibformat.fix_identifier_from_url('https://kth.diva-portal.org/smash/record.jsf?pid=diva2:1414460', 'doi')
+#scan_url yields all identifiers of a page as (byte offset, type, identifier), or only the first one of each type with first_match=True
+list(bibformat.scan_url('https://kth.diva-portal.org/smash/record.jsf?pid=diva2:1414460', ['doi', 'isbn'], first_match=True))
 #Option to verify that there exists a handle at doi.org (returns the DOI if yes, an empty string if no)
 bibformat.fix_doi("10.1364/JOSA.18.000337", online_check=True, check_what="handle")
 bibformat.fix_doi("10.9999/99999")
@@ -47,10 +51,34 @@ bibformat.fix_doi("10.1364/JOSA.18.000337", online_check=True, check_what="conte
 bibformat.fix_doi("10.5555/515151")
 bibformat.fix_doi("10.5555/515151", online_check=True, check_what="handle")
 bibformat.fix_doi("10.5555/515151", online_check=True, check_what="content")
+#By default the "content" check does not download the page ("stream" mode); HEAD requests and stopping at the doi.org redirection are also possible
+bibformat.identifier_has_location("10.1364/JOSA.18.000337", idtype='doi', mode="head", follow_redirects=False)
+#Bulk check of many identifiers, with a limited number of concurrent requests per host
+bibformat.identifiers_have_location(["10.1364/JOSA.18.000337", "10.5555/515151", "10.9999/99999"], idtype='doi', per_host=8)
 #Function to check if the DOI is based on an ISBN
 bibformat.doi_is_from_isbn("10.1364/JOSA.18.000337")
 bibformat.doi_is_from_isbn("10.1057/978-1-137-54575-6")
 
+#A filter of known DOIs (Bloom filter, about 1.2 bytes per DOI) can be built from a DOI dump, one DOI per line, and saved
+#When loaded (memory-mapped), the DOIs of the filter are accepted by the handle check without going online
+#bibformat.build_doi_filter('crossref_dois.txt', error_rate=0.01, output='crossref_dois.bloom')
+#bibformat.load_doi_filter('crossref_dois.bloom')
+#A registry of DOI prefixes rejects DOIs whose prefix does not exist at doi.org (each unknown prefix is checked once)
+#Valid prefixes are learned from successful checks, or preloaded from a list of prefixes (one per line)
+Prefixes = bibformat.load_doi_prefixes()
+bibformat.fix_doi("10.9999/99999", online_check=True)
+#Bulk check grouped by prefix
+bibformat.dois_have_handle(["10.1364/JOSA.18.000337", "10.9999/99999", "10.9999/99998"])
+Prefixes.save('doi_prefixes.txt')
+bibformat.unload_doi_prefixes()
+#Online check results can be cached in a file shared by all processes of the machine (SQLite)
+#Positive and negative results have separate lifetimes (seconds), answers affected by network/server errors are not cached
+bibformat.enable_verification_cache(positive_ttl=30*86400, negative_ttl=86400)
+bibformat.fix_doi("10.1364/JOSA.18.000337", online_check=True) #online
+bibformat.fix_doi("10.1364/JOSA.18.000337", online_check=True) #from the cache
+bibformat.VERIFICATION_CACHE.stats()
+bibformat.disable_verification_cache()
+
 
 ### ISSN ###
 #Same principle as above
@@ -64,6 +92,13 @@ bibformat.fix_issn("1477-5752", checksum=False) #check digit not verified
 bibformat.fix_issn("1477-5751", online_check=True)
 bibformat.fix_issn("0000-0000")
 bibformat.fix_issn("0000-0000", online_check=True)
+#Offline alternative to portal.issn.org: a registry loaded from the ISSN-to-ISSN-L table of the ISSN International Centre
+#(or any list of ISSNs), then used by the online check; it can be saved in a compact binary file for fast reloading
+#Registry = bibformat.load_issn_registry('ISSN-to-ISSN-L.txt', online_fallback=False)
+#Registry.save('issn_registry.bin')
+#bibformat.fix_issn("1477-5751", online_check=True)
+#Registry.issnl("1477-5751") #linking ISSN
+#Registry.contains_many(["1477-5751", "0000-0000"])
 
 
 ### PMID ###
@@ -87,12 +122,26 @@ bibformat.fix_isbn("978-0-14-104034-0")
 bibformat.fix_isbn("3-86717-055-0")
 bibformat.fix_isbn("978-0-14-104034-0", checksum=False) #check digit not verified
 bibformat.fix_isbn("3-86717-055-0", checksum=False) #check digit not verified
+#Check digits of a whole column (list, numpy array, pandas Series) at once, returns a boolean mask (requires numpy)
+bibformat.isbn_checkdigits(["978-0-14-104034-9", "3-86717-055-X", "3-86717-055-0"])
+bibformat.issn_checkdigits(["1477-5751", "1477-5752", "14775751"])
 #Option to verify if a corresponding book can be found (uses in sequence: LIBRIS, Google Books API, Open Library Book API, isbnsearch.org, www.books-by-isbn.com)
 bibformat.fix_isbn("978-0-14-104034-9", online_check=True)
 bibformat.fix_isbn("012-3-45-678901-2")
 bibformat.fix_isbn("012-3-45-678901-2", online_check=True)
 #This function indicates where the ISBN was found
 bibformat.isbn_has_content("978-0-14-104034-9", verbose=True)
+#The sources can also be queried concurrently ("race") or each after a short delay ("staggered"), with an overall deadline in seconds
+bibformat.isbn_has_content("978-0-14-104034-9", verbose=True, mode="race", deadline=10)
+bibformat.isbn_has_content("978-0-14-104034-9", verbose=True, mode="staggered", stagger=0.5, deadline=10)
+#Per-source statistics (calls, positive answers, errors, latency); adaptive=True orders the sources accordingly
+bibformat.isbn_source_stats()
+#Default options used by fix_isbn(..., online_check=True)
+bibformat.ISBN_CHECK_DEFAULTS["mode"] = "race"
+#Without timeout or deadline, each source of a race is given source_timeout seconds (the slower sources keep running after the answer)
+bibformat.ISBN_CHECK_DEFAULTS["source_timeout"] = 10
+#Bulk check of many ISBNs: Libris is queried with a few packed queries, the other sources only for the ISBNs not found there
+bibformat.isbns_have_content(["978-0-14-104034-9", "91-7501-031-3", "012-3-45-678901-2"], workers=4)
 #Similarly to other identifiers, this can be used to extract an ISBN number from a long text, for example on a webpage
 req2 = requests.get('http://libris.kb.se/bib/14701172')
 bibformat.fix_isbn(req2.text)
@@ -101,6 +150,59 @@ req3 = requests.get('https://www.amazon.com/dp/9175010313', headers={'User-Agent
 bibformat.fix_isbn(req3.text)
 
 
+### ALL IDENTIFIERS OF A TEXT ###
+#extract_identifiers scans the text once and yields every identifier found: (type, identifier, (start, end), check digit validity)
+#PMIDs are only extracted when labelled as such (e.g. "PMID: 5843660"), as any number has the PMID format
+list(bibformat.extract_identifiers(req1.text))
+#Restriction to some identifier types, keeping only ISBN/ISSN with a correct check digit
+list(bibformat.extract_identifiers(req3.text, ['isbn', 'issn'], only_valid=True))
+
+
+### BATCH ###
+#fix_identifiers applies the same format check to a whole list (or pandas Series) and returns aligned results
+#The compiled regular expression and check digit function are looked up once for the whole batch
+bibformat.fix_identifiers(["978-0-14-104034-9", "3-86717-055-0", "not an ISBN", None], 'isbn')
+#The predefined types (regular expression, check digit function, default online method) are listed here
+bibformat.IDENTIFIER_TYPES.keys()
+
+
+### LARGE FILES ###
+#scan_file finds all identifiers of a file without loading it in memory (memory map), optionally with several processes
+#It yields (byte offset, type, identifier); scan_stream does the same for a binary stream read in chunks
+#for offset, idtype, identifier in bibformat.scan_file('references.txt', idtypes=['doi', 'isbn'], processes=4):
+#    print(offset, idtype, identifier)
+
+
+### TABLES ###
+#normalize_table applies the format checks to whole columns of a pandas DataFrame or CSV file (requires pandas)
+#and adds a validity flag column for each identifier column; rows are processed in chunks, optionally in several processes
+#bibformat.normalize_table('export.csv', {"DOI": "doi", "ISBN": "isbn", "ISSN": "issn", "PMID": "pmid", "EID": "scopusid", "UT": "ut"}, output='export_clean.csv', processes=4)
+
+
+### DEDUPLICATION ###
+#Canonical forms make the same identifier written in different ways compare equal (ISBN-10 -> ISBN-13, decoded lower-case DOI, ISSN as an integer)
+bibformat.canonical_identifier("3-86717-055-X", 'isbn')
+bibformat.canonical_identifier("https://doi.org/10.1002%2FIJC.11382", 'doi')
+#cluster_records groups records (dicts, or rows of a pandas DataFrame) that share at least one identifier
+#and returns for each record the number of the first record of its group
+records = [{"DOI": "10.1002/ijc.11382"}, {"DOI": "10.1002%2FIJC.11382", "EID": "2-s2.0-84870230502"}, {"EID": "2-s2.0-84870230502"}, {"ISBN": "386717055X"}, {"ISBN": "978-3-86717-055-0"}]
+bibformat.cluster_records(records, {"DOI": "doi", "ISBN": "isbn", "EID": "scopusid"})
+#IdentifierClusters does the same for records added one by one (e.g. while reading several large exports)
+clusters = bibformat.IdentifierClusters({"DOI": "doi", "ISBN": "isbn", "EID": "scopusid"})
+clusters.update(records)
+clusters.duplicates()
+
+
+### PROFILING ###
+#The time spent by fix_identifier (and all fix_... functions) in regular expressions, check digits and online checks can be recorded per identifier type
+bibformat.enable_profiling()
+bibformat.fix_isbn("ISBN 978-0-14-104034-9")
+bibformat.fix_doi("https://doi.org/10.1364/JOSA.18.000337")
+print(bibformat.profiling_report())
+bibformat.disable_profiling()
+#Bench-bibformat.py measures the throughput and worst cases of the format checks on a generated corpus (python Bench-bibformat.py --help)
+
+
 ### Scopus ID ###
 #Same principle as above
 bibformat.fix_scopusid("2-s2.0-84870230502")
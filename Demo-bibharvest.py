@@ -0,0 +1,42 @@
+#!/usr/bin/python
+
+###########
+## NOTES ##
+## This module runs large harvests from the APIs supported by bibapi with several worker processes, on one or several machines.
+## A harvest is split into shards (by year, by identifier hash, by result range) stored as jobs in a queue file (SQLite).
+## Workers claim the jobs for a limited time (lease), write the records of each shard to a file, and failed jobs are retried.
+## When all jobs are done, the outputs are merged into one JSON lines file.
+############
+
+
+#IMPORTANT: define the API keys needed by the harvested services in environment variables, see Demo-bibapi.py
+#uncomment the line below and define your Scopus API key
+#os.environ['SCOPUS_KEY'] =
+
+import os
+import bibharvest
+
+#The workers are separate processes (multiprocessing): the harvest must only be run when the script is executed directly
+if __name__ == '__main__':
+    ### CREATE A HARVEST ###
+    queue = bibharvest.HarvestQueue('harvest.sqlite')
+    #OpenAlex works of an institution, one shard per publication year
+    queue.create('kth-openalex', 'openalex_works', bibharvest.shards_by_year(2015, 2024), {"filter": "institutions.ror:026vcq606"})
+    #OpenAlex records of a list of DOIs, split into 16 shards by hash
+    queue.create('dois-openalex', 'openalex_dois', bibharvest.shards_by_id_hash(["10.1002/ijc.11382", "10.1364/JOSA.18.000337"], 16))
+    #Scopus search whose number of results is known, split into ranges of 1000 results
+    queue.create('kth-scopus', 'scopus_search', bibharvest.shards_by_range(4800, 1000), {"query": "AF-ID(60002014) AND PUBYEAR = 2020"})
+
+    ### RUN THE WORKERS ###
+    #4 worker processes on this machine; other machines sharing the file can run workers at the same time:
+    #   python bibutils.py harvest work harvest.sqlite kth-openalex -j 4
+    bibharvest.run_workers('harvest.sqlite', 'kth-openalex', processes=4)
+    #Number of jobs per state and number of records
+    queue.status('kth-openalex')
+    #Jobs that failed after all their attempts, and how to retry them
+    queue.failures('kth-openalex')
+    queue.retry_failed('kth-openalex')
+
+    ### MERGE ###
+    #Records of all shards in shard order, without duplicates
+    queue.merge('kth-openalex', 'kth-openalex.jsonl', key=lambda record: record["id"])
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+#Regression tests of bibformat (offline: no network access or API key needed)
+#Example:
+#   python Test-bibformat.py
+#Exit code 1 if a check fails
+
+import io
+import os
+import sys
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import bibformat
+
+FAILURES = []
+
+def check(name, ok, detail=""):
+    print(("OK    " if ok else "FAIL  ") + name + (" " + detail if detail else ""))
+    if not ok:
+        FAILURES.append(name)
+
+### EXTRACTION ###
+
+#An ISBN-like candidate with a wrong check digit must not hide the valid ISSN starting at the same position
+REFERENCE = "Nature, ISSN 0028-0836 12 (2020) 345-350"
+
+def test_extraction():
+    found = list(bibformat.extract_identifiers(REFERENCE))
+    check("extract_identifiers: ISSN before a number", found == [('issn', '0028-0836', (13, 22), True)], str(found))
+    found = list(bibformat.extract_identifiers(REFERENCE, only_valid=True))
+    check("extract_identifiers only_valid: ISSN before a number", found == [('issn', '0028-0836', (13, 22), True)], str(found))
+    check("fix_issn agrees", bibformat.fix_issn(REFERENCE) == '0028-0836')
+    #A valid ISBN is still reported as such, an invalid one without valid alternative is kept (flagged as invalid)
+    found = [(t, i, v) for t, i, span, v in bibformat.extract_identifiers("ISBN 978-0-306-40615-7, ISBN 978-0-306-40615-8")]
+    check("extract_identifiers: valid and invalid ISBN", found == [('isbn', '978-0-306-40615-7', True), ('isbn', '978-0-306-40615-8', False)], str(found))
+
+### SCANS ###
+
+def test_scans():
+    #The reference repeated in a file, so that some occurrences straddle the chunk and range boundaries
+    data = ((REFERENCE + "\n") * 2000).encode()
+    offsets = [i*(len(REFERENCE)+1) + 13 for i in range(2000)]
+    expected = [(offset, 'issn', '0028-0836') for offset in offsets]
+    for only_valid in [False, True]:
+        found = list(bibformat.scan_stream(io.BytesIO(data), chunksize=1000, overlap=100, only_valid=only_valid))
+        check("scan_stream only_valid=" + str(only_valid), found == expected, str(len(found)) + " identifiers, first " + str(found[:1]))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'references.txt')
+        with open(path, 'wb') as f:
+            f.write(data)
+        for only_valid in [False, True]:
+            found = sorted(bibformat.scan_file(path, rangesize=5000, overlap=100, only_valid=only_valid))
+            check("scan_file only_valid=" + str(only_valid), found == expected, str(len(found)) + " identifiers, first " + str(found[:1]))
+
+#Web page served by a local server, in small chunks
+class PageHandler(BaseHTTPRequestHandler):
+    page = ("<html><body>" + "<p>filler text</p>" * 500 + "<p>" + REFERENCE + "</p></body></html>").encode()
+    def log_message(self, *args):
+        pass
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(self.page)))
+        self.end_headers()
+        self.wfile.write(self.page)
+
+def test_urls():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:" + str(server.server_port) + "/record"
+    offset = PageHandler.page.index(b"0028-0836")
+    try:
+        found = list(bibformat.scan_url(url, chunksize=1000))
+        check("scan_url", found == [(offset, 'issn', '0028-0836')], str(found))
+        found = list(bibformat.scan_url(url, ['isbn', 'issn'], first_match=True, only_valid=True, chunksize=1000))
+        check("scan_url first_match only_valid", found == [(offset, 'issn', '0028-0836')], str(found))
+        check("fix_identifier_from_url issn", bibformat.fix_identifier_from_url(url, 'issn') == '0028-0836')
+        check("fix_identifier_from_url isbn (wrong check digit)", bibformat.fix_identifier_from_url(url, 'isbn') == '')
+    finally:
+        server.shutdown()
+
+def run():
+    test_extraction()
+    test_scans()
+    test_urls()
+    return FAILURES
+
+if __name__ == '__main__':
+    sys.exit(1 if run() else 0)
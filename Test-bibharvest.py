@@ -0,0 +1,107 @@
+#!/usr/bin/python
+
+#Test of bibharvest against a local stub of the OpenAlex API (no network access or API key needed)
+#The stub pages the works of each publication year with a cursor and answers 10% of the requests with HTTP 500
+#Checked:
+# - all the works are harvested once and merged in shard order, despite the HTTP 500 errors (page retries and job retries)
+# - a job claimed by a worker that died (expired lease) is taken over by another worker
+# - the harvest requests are sent with the "batch" scheduling priority
+#Example:
+#   python Test-bibharvest.py
+#Exit code 1 if a check fails
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import bibapi
+import bibharvest
+
+YEARS = range(2010, 2022)
+
+def stub_works():
+    rnd = random.Random(0)
+    return {year: [{"id": "W" + str(year) + "_" + str(i), "publication_year": year} for i in range(rnd.randrange(0, 900))] for year in YEARS}
+
+### STUB SERVER ###
+
+class StubHandler(BaseHTTPRequestHandler):
+    works = stub_works()
+    rnd = random.Random(1)
+    def log_message(self, *args):
+        pass
+    def do_GET(self):
+        if self.rnd.random() < 0.1:
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        year = int(query["filter"][0].split("publication_year:")[1])
+        perpage = int(query["per-page"][0])
+        cursor = query["cursor"][0]
+        start = 0 if cursor == "*" else int(cursor)
+        nextcursor = str(start + perpage) if start + perpage < len(self.works[year]) else None
+        body = json.dumps({"meta": {"next_cursor": nextcursor}, "results": self.works[year][start:start+perpage]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+#Requests of the workers are sent to the stub (its address is given to the worker processes through an environment variable)
+BibAPICall = bibapi.BibAPI.call
+
+def stub_call(self, path, **kwargs):
+    if bibapi.current_priority() != "batch":
+        raise AssertionError("harvest request sent with priority " + str(bibapi.current_priority()))
+    self.base_url = os.environ["BIBHARVEST_TEST_URL"]
+    return BibAPICall(self, path, **kwargs)
+
+bibapi.BibAPI.call = stub_call
+
+### TEST ###
+
+def run():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["BIBHARVEST_TEST_URL"] = "http://127.0.0.1:" + str(server.server_port) + "/"
+    tmpdir = tempfile.mkdtemp()
+    failures = []
+    def check(name, ok, detail=""):
+        print(("OK    " if ok else "FAIL  ") + name + (" " + detail if detail else ""))
+        if not ok:
+            failures.append(name)
+    try:
+        path = os.path.join(tmpdir, "harvest.sqlite")
+        queue = bibharvest.HarvestQueue(path)
+        queue.create("test", "openalex_works", bibharvest.shards_by_year(YEARS[0], YEARS[-1]), {"filter": "institutions.ror:000000000", "per_page": 100, "retry_delay": 0.05})
+        #A worker that claims a job and dies: the job is taken over when its lease expires
+        zombie = bibharvest.HarvestQueue(path, lease=1).claim("test", "zombie")
+        t0 = time.time()
+        status = bibharvest.run_workers(path, "test", processes=4, lease=1, retry_delay=0.1, poll=0.2)
+        print("Harvest: " + str(status) + " in %.1f s" % (time.time() - t0))
+        check("all jobs done", status.get("done") == len(YEARS), str(status))
+        output = os.path.join(tmpdir, "out.jsonl")
+        queue.merge("test", output, key=lambda record: record["id"])
+        with open(output, encoding='utf-8') as f:
+            ids = [json.loads(line)["id"] for line in f]
+        expected = [work["id"] for year in YEARS for work in StubHandler.works[year]]
+        check("merged records", ids == expected, str(len(ids)) + " records, " + str(len(expected)) + " expected")
+        connection = queue.connect()
+        owner = connection.execute("SELECT owner FROM jobs WHERE harvest=? AND job=?", ("test", zombie[0])).fetchone()
+        connection.close()
+        check("expired lease taken over", owner is not None and owner[0] != "zombie", str(owner))
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return failures
+
+if __name__ == '__main__':
+    sys.exit(1 if run() else 0)
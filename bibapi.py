@@ -6,6 +6,13 @@
 import os
 import requests
 
+#For the resilience layer and the scheduler
+import threading
+import contextlib
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
 #For other functions
 from xml.etree import cElementTree as ET
 import time
@@ -18,7 +25,570 @@ LENS_TOKEN = os.getenv('LENS_TOKEN')
 ALTMETRICS_API_KEY = os.getenv('ALTMETRICS_API_KEY')
 WOS_KEY = os.getenv('WOS_KEY')
 OVERTON_KEY = os.getenv('OVERTON_KEY')
-    
+
+
+## Resilience layer (opt-in, see enable_resilience)
+
+#Raised instead of sending a request while the circuit of the target host is open
+class CircuitOpenError(requests.exceptions.RequestException):
+    pass
+
+#Raised when the deadline budget of a call is spent before any attempt has answered
+class DeadlineExceeded(requests.exceptions.Timeout):
+    pass
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker:
+     - closed: requests go through, consecutive failures are counted
+     - open: requests fail fast until reset_timeout seconds have elapsed
+     - half_open: a single trial request goes through, its outcome closes or reopens the circuit
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.nopened = 0
+        self.nrejected = 0
+        self.lock = threading.Lock()
+    def current_state(self):
+        with self.lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half_open'
+            return self.state
+    def allow(self):
+        with self.lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.nrejected += 1
+                    return False
+                self.state = 'half_open'
+                self.trial_running = False
+            if self.state == 'half_open':
+                if self.trial_running:
+                    self.nrejected += 1
+                    return False
+                self.trial_running = True
+            return True
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.trial_running = False
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.nopened += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+class Resilience:
+    """
+    Request wrapper adding, for each call:
+     - a deadline budget (seconds) shared by all attempts, also used to cap the per-attempt timeout
+     - a hedged duplicate request (GET/HEAD sent with requests.get/requests.head or hedgeable functions), sent when the first attempt
+       has not answered after the hedge_quantile (default p95) of the latencies recently observed for the host
+     - a per-host circuit breaker failing fast (CircuitOpenError) while a host is down
+    Failures are exceptions from requests and HTTP status codes 429 and 5xx.
+    """
+    def __init__(self, deadline=30.0, hedge=True, hedge_quantile=0.95, hedge_min_delay=0.05, min_samples=20, window=200, failure_threshold=5, reset_timeout=30.0, max_workers=16):
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.hosts = {}
+        self.lock = threading.Lock()
+    def host(self, hostname):
+        with self.lock:
+            if hostname not in self.hosts:
+                self.hosts[hostname] = {"breaker": CircuitBreaker(self.failure_threshold, self.reset_timeout),
+                                            "latencies": deque(maxlen=self.window),
+                                            "requests": 0,
+                                            "failures": 0,
+                                            "hedged": 0,
+                                            "hedge_wins": 0,
+                                            "deadline_exceeded": 0}
+            return self.hosts[hostname]
+    #Statistics of a host, updated from the threads of all callers and of the executor
+    def count(self, stats, name):
+        with self.lock:
+            stats[name] += 1
+    def latency_quantile(self, hostname, q=None):
+        stats = self.host(hostname)
+        with self.lock:
+            latencies = sorted(stats["latencies"])
+        if len(latencies) < self.min_samples:
+            return None
+        if q is None:
+            q = self.hedge_quantile
+        return latencies[min(len(latencies)-1, int(q*len(latencies)))]
+    def request(self, method, url, deadline=None, **kwargs):
+        hostname = urllib.parse.urlsplit(url).netloc
+        stats = self.host(hostname)
+        breaker = stats["breaker"]
+        if not breaker.allow():
+            raise CircuitOpenError("Circuit open for host " + hostname + ", request not sent: " + url)
+        if deadline is None:
+            deadline = self.deadline
+        end = time.monotonic() + deadline if deadline else None
+        self.count(stats, "requests")
+        try:
+            response = self.attempts(method, url, hostname, stats, end, kwargs)
+        except BaseException:
+            #Any exception (also e.g. a ValueError for invalid parameters) ends a half-open trial, which would otherwise block the host
+            self.count(stats, "failures")
+            breaker.record_failure()
+            raise
+        if response.status_code == 429 or response.status_code >= 500:
+            self.count(stats, "failures")
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+    #Only idempotent requests sent with the functions requests.get/requests.head (or functions marked hedgeable, e.g. bibformat.session_get)
+    #are hedged and run in the executor:
+    #other methods (POST...) and methods of a Session (not thread-safe) are sent once from the calling thread,
+    #the deadline being enforced through the timeout only
+    def attempts(self, method, url, hostname, stats, end, kwargs):
+        def attempt():
+            akwargs = dict(kwargs)
+            if end is not None:
+                akwargs["timeout"] = cap_timeout(akwargs.get("timeout"), max(end - time.monotonic(), 0.001))
+            t0 = time.monotonic()
+            res = method(url, **akwargs)
+            with self.lock:
+                stats["latencies"].append(time.monotonic() - t0)
+            return res
+        hedgeable = getattr(method, 'hedgeable', False) or (getattr(method, '__name__', None) in ('get', 'head') and not hasattr(method, '__self__'))
+        delay = self.latency_quantile(hostname) if self.hedge and hedgeable else None
+        if not hedgeable or (end is None and delay is None):
+            try:
+                return attempt()
+            except requests.exceptions.Timeout:
+                if end is not None and time.monotonic() >= end:
+                    self.count(stats, "deadline_exceeded")
+                    raise DeadlineExceeded("Deadline exceeded for " + url)
+                raise
+        futures = [self.executor.submit(attempt)]
+        if delay is not None:
+            delay = max(delay, self.hedge_min_delay)
+            if end is not None:
+                delay = min(delay, max(end - time.monotonic(), 0))
+            done, _ = wait(futures, timeout=delay)
+            if not done and (end is None or time.monotonic() < end):
+                futures.append(self.executor.submit(attempt))
+                self.count(stats, "hedged")
+        pending = set(futures)
+        lasterror = None
+        while pending:
+            remaining = None if end is None else end - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for f in done:
+                try:
+                    res = f.result()
+                except requests.exceptions.RequestException as e:
+                    lasterror = e
+                    continue
+                if len(futures) > 1 and f is futures[1]:
+                    self.count(stats, "hedge_wins")
+                for other in futures:
+                    if other is not f:
+                        other.add_done_callback(close_response)
+                return res
+        if lasterror is not None and not pending:
+            raise lasterror
+        for f in futures:
+            f.add_done_callback(close_response)
+        self.count(stats, "deadline_exceeded")
+        raise DeadlineExceeded("Deadline exceeded for " + url)
+    def metrics(self):
+        res = {}
+        for hostname in list(self.hosts):
+            stats = self.hosts[hostname]
+            breaker = stats["breaker"]
+            state = breaker.current_state()
+            res[hostname] = {"state": state,
+                                 "open": int(state == 'open'),
+                                 "half_open": int(state == 'half_open'),
+                                 "times_opened": breaker.nopened,
+                                 "rejected": breaker.nrejected,
+                                 "requests": stats["requests"],
+                                 "failures": stats["failures"],
+                                 "hedged": stats["hedged"],
+                                 "hedge_wins": stats["hedge_wins"],
+                                 "deadline_exceeded": stats["deadline_exceeded"],
+                                 "p95": self.latency_quantile(hostname, 0.95)}
+        return res
+
+#Timeout capped by the remaining time of a deadline, also for a (connect, read) tuple timeout
+def cap_timeout(timeout, remaining):
+    if isinstance(timeout, tuple):
+        return tuple(min(t or remaining, remaining) for t in timeout)
+    return min(timeout or remaining, remaining)
+
+#Done callback releasing the connection of an attempt whose response is not used (lost hedge or exceeded deadline)
+def close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+#Module-level resilience settings, shared by all BibAPI clients and by bibformat online checks (None = disabled)
+RESILIENCE = None
+
+def enable_resilience(**kwargs):
+    global RESILIENCE
+    RESILIENCE = Resilience(**kwargs)
+    return RESILIENCE
+
+def disable_resilience():
+    global RESILIENCE
+    RESILIENCE = None
+
+def resilience_metrics():
+    if RESILIENCE:
+        return RESILIENCE.metrics()
+    return {}
+
+#Sends a request through the resilience layer if enabled, directly otherwise
+def resilient_call(method, url, deadline=None, **kwargs):
+    if RESILIENCE:
+        return RESILIENCE.request(method, url, deadline=deadline, **kwargs)
+    return method(url, **kwargs)
+
+
+## Scheduler (opt-in, see enable_scheduler)
+
+#Priority classes, from highest to lowest
+PRIORITIES = ["interactive", "batch"]
+
+#Priority class of the calls made by the current thread (see scheduling_priority)
+SCHEDULING = threading.local()
+
+#Sets the priority class of the BibAPI calls made by the current thread, e.g.
+#   with bibapi.scheduling_priority("batch"):
+#       harvest()
+#Worker threads started inside the block do not inherit it and must set it themselves (see current_priority)
+@contextlib.contextmanager
+def scheduling_priority(priority):
+    previous = getattr(SCHEDULING, 'priority', None)
+    SCHEDULING.priority = priority
+    try:
+        yield
+    finally:
+        SCHEDULING.priority = previous
+
+def current_priority():
+    priority = getattr(SCHEDULING, 'priority', None)
+    if priority is None and SCHEDULER:
+        return SCHEDULER.default_priority
+    return priority or PRIORITIES[0]
+
+class ServiceQueue:
+    """
+    Queue of the calls to one service:
+     - at most limit calls in flight, and at most rate calls per second (token bucket of burst calls, None: no rate limit)
+     - one FIFO queue per priority class, served in priority order, except that one waiting batch call is served
+       after every batch_every calls of higher priority (so that batch work keeps a share of the quota)
+     - latencies (queue wait and total, seconds) of the recent calls of each class, for SLO tracking
+    """
+    def __init__(self, limit, rate, burst, batch_every, window):
+        self.limit = limit
+        self.rate = rate
+        self.burst = burst if burst else max(1.0, rate or 1.0)
+        self.tokens = self.burst
+        self.refilled = time.monotonic()
+        self.batch_every = batch_every
+        self.running = 0
+        self.since_low = 0
+        self.waiting = {p: deque() for p in PRIORITIES}
+        self.stats = {p: {"requests": 0, "slo_violations": 0, "waits": deque(maxlen=window), "latencies": deque(maxlen=window)} for p in PRIORITIES}
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled)*self.rate)
+        self.refilled = now
+    #Ticket to be served next (None if the queue is empty)
+    def head(self):
+        nonempty = [p for p in PRIORITIES if self.waiting[p]]
+        if not nonempty:
+            return None
+        lowest = nonempty[-1]
+        if len(nonempty) > 1 and self.batch_every and self.since_low >= self.batch_every:
+            return self.waiting[lowest][0]
+        return self.waiting[nonempty[0]][0]
+    #Seconds before the next token is available (0 if a call can start now)
+    def token_delay(self):
+        if not self.rate or self.tokens >= 1:
+            return 0
+        return (1 - self.tokens)/self.rate
+
+class Scheduler:
+    """
+    Scheduler of the BibAPI calls, per service (per-service fair queuing: a backlog on one service never delays the others):
+     - limits: maximum number of calls in flight per service (default_limit for the services not listed)
+     - rates: maximum number of calls per second per service (e.g. the quota of an API key), bursts of up to bursts[service] calls
+     - priority classes (PRIORITIES): interactive calls jump ahead of queued batch calls,
+       one batch call is still served after every batch_every interactive calls while both are waiting
+     - slo: target latency (seconds, queue wait included) per priority class, violations are counted in metrics()
+    """
+    def __init__(self, limits={}, default_limit=4, rates={}, bursts={}, default_priority="interactive", batch_every=10, slo={"interactive": 2.0, "batch": None}, window=500):
+        self.limits = dict(limits)
+        self.default_limit = default_limit
+        self.rates = dict(rates)
+        self.bursts = dict(bursts)
+        self.default_priority = default_priority
+        self.batch_every = batch_every
+        self.slo = dict(slo)
+        self.window = window
+        self.services = {}
+        self.condition = threading.Condition()
+    def queue(self, service):
+        if service not in self.services:
+            self.services[service] = ServiceQueue(self.limits.get(service, self.default_limit), self.rates.get(service), self.bursts.get(service), self.batch_every, self.window)
+        return self.services[service]
+    #Waits for a slot of the service and returns the ticket to give back to release()
+    def acquire(self, service, priority=None):
+        priority = priority or current_priority()
+        if priority not in PRIORITIES:
+            print("Unknown priority class: " + str(priority) + ", treated as " + PRIORITIES[-1])
+            priority = PRIORITIES[-1]
+        ticket = {"service": service, "priority": priority, "queued": time.monotonic(), "started": None}
+        with self.condition:
+            queue = self.queue(service)
+            queue.waiting[priority].append(ticket)
+            while True:
+                now = time.monotonic()
+                queue.refill(now)
+                delay = queue.token_delay()
+                if queue.head() is ticket and queue.running < queue.limit and delay == 0:
+                    break
+                self.condition.wait(timeout=delay or None)
+            queue.waiting[priority].popleft()
+            queue.running += 1
+            if queue.rate:
+                queue.tokens -= 1
+            if priority == PRIORITIES[-1] or not queue.waiting[PRIORITIES[-1]]:
+                queue.since_low = 0
+            else:
+                queue.since_low += 1
+            ticket["started"] = time.monotonic()
+            #The next ticket may be startable too (free slot and token)
+            self.condition.notify_all()
+        return ticket
+    def release(self, ticket):
+        now = time.monotonic()
+        with self.condition:
+            queue = self.services[ticket["service"]]
+            queue.running -= 1
+            stats = queue.stats[ticket["priority"]]
+            stats["requests"] += 1
+            stats["waits"].append(ticket["started"] - ticket["queued"])
+            stats["latencies"].append(now - ticket["queued"])
+            target = self.slo.get(ticket["priority"])
+            if target is not None and now - ticket["queued"] > target:
+                stats["slo_violations"] += 1
+            self.condition.notify_all()
+    @contextlib.contextmanager
+    def slot(self, service, priority=None):
+        ticket = self.acquire(service, priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+    def metrics(self):
+        def quantile(values, q):
+            values = sorted(values)
+            return values[min(len(values)-1, int(q*len(values)))] if values else None
+        res = {}
+        with self.condition:
+            for service, queue in self.services.items():
+                res[service] = {"running": queue.running, "limit": queue.limit, "rate": queue.rate}
+                for p in PRIORITIES:
+                    stats = queue.stats[p]
+                    target = self.slo.get(p)
+                    recent = list(stats["latencies"])
+                    res[service][p] = {"requests": stats["requests"],
+                                           "queued": len(queue.waiting[p]),
+                                           "wait_p50": quantile(stats["waits"], 0.5),
+                                           "wait_p95": quantile(stats["waits"], 0.95),
+                                           "latency_p50": quantile(recent, 0.5),
+                                           "latency_p95": quantile(recent, 0.95),
+                                           "slo": target,
+                                           "slo_violations": stats["slo_violations"],
+                                           "slo_attainment": (sum(t <= target for t in recent)/len(recent)) if (target is not None and recent) else None}
+        return res
+
+#Module-level scheduler, shared by all BibAPI clients (None = disabled, calls are sent immediately)
+SCHEDULER = None
+
+def enable_scheduler(**kwargs):
+    global SCHEDULER
+    SCHEDULER = Scheduler(**kwargs)
+    return SCHEDULER
+
+def disable_scheduler():
+    global SCHEDULER
+    SCHEDULER = None
+
+def scheduler_metrics():
+    if SCHEDULER:
+        return SCHEDULER.metrics()
+    return {}
+
+
+## Response cache with conditional revalidation (opt-in, see enable_response_cache)
+
+#Connection to the SQLite file owner.path of a persistent cache (ResponseCache, bibformat.VerificationCache), created with the table of schema
+#One connection per process, kept in owner.connection (connections must not be shared across fork), used under the lock of the owner
+#WAL mode: readers are not blocked by a writer of another process (the file must be on a local disk)
+def sqlite_connection(owner, schema):
+    import sqlite3
+    if owner.connection is None or owner.pid != os.getpid():
+        owner.connection = sqlite3.connect(owner.path, timeout=60, check_same_thread=False, isolation_level=None)
+        owner.connection.execute("PRAGMA journal_mode=WAL")
+        owner.connection.execute(schema)
+        owner.pid = os.getpid()
+    return owner.connection
+
+class ResponseCache:
+    """
+    Persistent cache of the GET responses of BibAPI calls, in an SQLite file that can be shared by several processes
+     - the body is stored with its validators (ETag, Last-Modified)
+     - a response younger than ttl seconds is served without any request (ttl=0: always revalidated)
+     - an older one is revalidated with If-None-Match/If-Modified-Since: a 304 answer refreshes it without transferring the body
+     - responses without validators are only kept if ttl > 0, responses with Cache-Control: no-store are never kept
+     - services: services whose calls are cached (None: all)
+    Keys are hashes of the URL (which can contain API keys), of the Accept header and of the credentials sent in headers
+    (KEY_HEADERS), so that callers with different API keys or entitlements do not share responses
+    """
+    STORED_HEADERS = ["Content-Type", "ETag", "Last-Modified"]
+    KEY_HEADERS = ["accept", "authorization", "cookie", "x-apikey", "x-els-apikey", "x-els-insttoken", "x-els-authtoken"]
+    def __init__(self, path, ttl=0, services=None):
+        self.path = path
+        self.ttl = ttl
+        self.services = services
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pid = None
+        self.counts = {"requests": 0, "fresh_hits": 0, "revalidations": 0, "not_modified": 0, "modified": 0, "stored": 0, "bytes_saved": 0, "bytes_downloaded": 0}
+    def connect(self):
+        return sqlite_connection(self, "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, headers TEXT, body BLOB, checked REAL)")
+    def covers(self, service):
+        return self.services is None or service in self.services
+    def key(self, url, headers):
+        import hashlib
+        keyheaders = sorted((k.lower(), str(v)) for k, v in headers.items() if k.lower() in self.KEY_HEADERS)
+        return hashlib.sha256((url + ''.join('\n' + k + ': ' + v for k, v in keyheaders)).encode()).hexdigest()
+    def get(self, key):
+        import json
+        with self.lock:
+            row = self.connect().execute("SELECT headers, body, checked FROM responses WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        return {"headers": json.loads(row[0]), "body": row[1], "checked": row[2]}
+    def put(self, key, headers, body):
+        import json
+        with self.lock:
+            self.connect().execute("INSERT OR REPLACE INTO responses VALUES (?,?,?,?)", (key, json.dumps(headers), body, time.time()))
+    def touch(self, key, headers):
+        import json
+        with self.lock:
+            self.connect().execute("UPDATE responses SET headers=?, checked=? WHERE key=?", (json.dumps(headers), time.time(), key))
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] += n
+    #Returns the response of a GET request of url, send(extra_headers) sending the actual request
+    def fetch(self, url, headers, send):
+        key = self.key(url, headers)
+        entry = self.get(key)
+        self.count("requests")
+        if entry is not None and self.ttl and time.time() - entry["checked"] < self.ttl:
+            self.count("fresh_hits")
+            self.count("bytes_saved", len(entry["body"]))
+            return self.response(url, entry)
+        conditional = {}
+        if entry is not None:
+            if "ETag" in entry["headers"]:
+                conditional["If-None-Match"] = entry["headers"]["ETag"]
+            if "Last-Modified" in entry["headers"]:
+                conditional["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+            if conditional:
+                self.count("revalidations")
+        response = send(conditional)
+        if entry is not None and conditional and response.status_code == 304:
+            self.count("not_modified")
+            self.count("bytes_saved", len(entry["body"]))
+            #A 304 answer can carry updated validators
+            for h in ["ETag", "Last-Modified"]:
+                if h in response.headers:
+                    entry["headers"][h] = response.headers[h]
+            self.touch(key, entry["headers"])
+            return self.response(url, entry)
+        if response.status_code == 200:
+            self.count("bytes_downloaded", len(response.content))
+            if conditional:
+                self.count("modified")
+            stored = {h: response.headers[h] for h in self.STORED_HEADERS if h in response.headers}
+            nostore = "no-store" in response.headers.get("Cache-Control", "").lower()
+            if not nostore and ("ETag" in stored or "Last-Modified" in stored or self.ttl):
+                self.put(key, stored, response.content)
+                self.count("stored")
+        return response
+    #Response object rebuilt from a cache entry (from_cache=True)
+    def response(self, url, entry):
+        response = requests.models.Response()
+        response.status_code = 200
+        response._content = entry["body"]
+        response.headers = requests.structures.CaseInsensitiveDict(entry["headers"])
+        response.url = url
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.from_cache = True
+        return response
+    def purge(self, max_age):
+        with self.lock:
+            self.connect().execute("DELETE FROM responses WHERE checked<?", (time.time() - max_age,))
+    def metrics(self):
+        with self.lock:
+            res = dict(self.counts)
+            res["entries"] = self.connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        res["requests_saved"] = res["fresh_hits"]
+        res["revalidation_hit_rate"] = res["not_modified"]/res["revalidations"] if res["revalidations"] else None
+        return res
+
+#Module-level response cache, shared by all BibAPI clients (None = disabled)
+RESPONSE_CACHE = None
+
+##Enables the response cache for the GET calls of BibAPI (e.g. enable_response_cache(services=["ror", "doaj", "openapc"]))
+##Default path: environment variable BIBAPI_RESPONSE_CACHE, or bibapi_response_cache.sqlite in the temporary directory
+def enable_response_cache(path=None, ttl=0, services=None):
+    import tempfile
+    global RESPONSE_CACHE
+    if not path:
+        path = os.getenv('BIBAPI_RESPONSE_CACHE') or os.path.join(tempfile.gettempdir(), 'bibapi_response_cache.sqlite')
+    RESPONSE_CACHE = ResponseCache(path, ttl=ttl, services=services)
+    return RESPONSE_CACHE
+
+def disable_response_cache():
+    global RESPONSE_CACHE
+    RESPONSE_CACHE = None
+
+#Requests, fresh hits, revalidations, 304 answers, bytes saved/downloaded, entries
+def response_cache_metrics():
+    if RESPONSE_CACHE:
+        return RESPONSE_CACHE.metrics()
+    return {}
+
 
 #- ncbi (pubmed)
 
@@ -92,6 +662,7 @@ class BibAPI:
                                 'format',
                                 'identifiers',
                                 'open_linked_institution_authors',
+                                'page',
                                 'plain_dois_cited',
                                 'query',
                                 'sort']
@@ -271,7 +842,7 @@ class BibAPI:
         self.timeout = timeout
     def setMethod(self, method):
         self.method = method
-    def call(self, path, params={}, headers={}, proxies={}, timeout=None, method=None, casesensitive=False):
+    def call(self, path, params={}, headers={}, proxies={}, timeout=None, method=None, casesensitive=False, deadline=None, priority=None):
         #self.service and self.apiname should already be set
         if not headers:
             headers = self.headers
@@ -300,7 +871,17 @@ class BibAPI:
         #remove extra '&' (or '?' if there are no parameters)
         url = url[:-1]
         self.lasturl = url
-        self.lastresponse = method(url, headers=headers, proxies=proxies, timeout=timeout)
+        def send(extraheaders):
+            sentheaders = dict(headers, **extraheaders) if extraheaders else headers
+            if SCHEDULER:
+                with SCHEDULER.slot(self.service, priority):
+                    return resilient_call(method, url, deadline=deadline, headers=sentheaders, proxies=proxies, timeout=timeout)
+            return resilient_call(method, url, deadline=deadline, headers=sentheaders, proxies=proxies, timeout=timeout)
+        if RESPONSE_CACHE and method is requests.get and RESPONSE_CACHE.covers(self.service):
+            #Served from the cache or revalidated (the scheduler is only involved when a request is actually sent)
+            self.lastresponse = RESPONSE_CACHE.fetch(url, headers, send)
+        else:
+            self.lastresponse = send({})
         try:
             return self.lastresponse.json()
         except:
@@ -411,6 +992,19 @@ def doi_handle(doi,headers={},proxies={},timeout=None):
     res = TheClient.doi(path=doi, params={"type": "URL"}, headers=headers, proxies=proxies, timeout=timeout)
     return str(safe_access(res, ["values", 0, "data","value"],""))
 
+#Checks that a DOI prefix (registrant code, e.g. 10.1364) exists at doi.org, via its prefix handle 0.NA/<prefix>
+#Returns True (exists), False (does not exist) or None (no conclusive answer)
+def doi_prefix_exists(prefix,headers={},proxies={},timeout=None):
+    TheClient = BibAPI()
+    res = TheClient.doi(path="0.NA/"+prefix, headers=headers, proxies=proxies, timeout=timeout)
+    code = safe_access(res, ["responseCode"], 0)
+    if code == 1:
+        return True
+    elif code == 100:
+        return False
+    else:
+        return None
+
 def altmetric_score(pub):
     TheClient = BibAPI()
     pubtype = next(iter(pub))
@@ -431,6 +1025,99 @@ def libris_isbn_search(isbn,headers={},proxies={},timeout=None):
     TheClient = BibAPI()
     return TheClient.libris(params={"query": "ISBN:"+isbn}, headers=headers, proxies=proxies, timeout=timeout)
 
+#Maximum length (URL-encoded) of the query of a bulk Libris search and number of records per page (xsearch maximum: 200)
+LIBRIS_QUERY_LIMIT = 2000
+LIBRIS_PAGE_SIZE = 200
+
+#ISBN-10 and ISBN-13 forms (without dashes and spaces, upper case) of an ISBN, used to match Libris records with the searched ISBNs
+def isbn_forms(isbn):
+    isbn = isbn.replace('-','').replace(' ','').upper()
+    forms = {isbn}
+    if len(isbn) == 10 and isbn[:9].isdigit():
+        core = '978' + isbn[:9]
+        forms.add(core + str((10 - sum((1+2*(i%2))*int(x) for i,x in enumerate(core)) % 10) % 10))
+    elif len(isbn) == 13 and isbn.startswith('978') and isbn.isdigit():
+        core = isbn[3:12]
+        checksum = (11 - sum((10-i)*int(x) for i,x in enumerate(core)) % 11) % 11
+        forms.add(core + ('X' if checksum == 10 else str(checksum)))
+    return forms
+
+#ISBNs of a Libris record (the isbn field is a string or a list, values can have a qualifier, e.g. "9789127123456 (inb.)")
+def libris_record_isbns(record):
+    values = record.get("isbn", []) if isinstance(record, dict) else []
+    if isinstance(values, str):
+        values = [values]
+    isbns = set()
+    for value in values:
+        for token in str(value).replace('-','').split():
+            if len(token) in [10, 13] and token[:9].isdigit():
+                isbns |= isbn_forms(token)
+    return isbns
+
+#Groups the ISBNs into queries "ISBN:a OR ISBN:b OR ..." of at most querylimit characters once URL-encoded
+def libris_isbn_queries(isbns, querylimit):
+    queries = []
+    terms = []
+    length = 0
+    for isbn in isbns:
+        term = urllib.parse.quote("ISBN:" + isbn)
+        extra = len(term) + len(terms and urllib.parse.quote(" OR ") or "")
+        if terms and length + extra > querylimit:
+            queries.append(terms)
+            terms = []
+            length = 0
+            extra = len(term)
+        terms.append(isbn)
+        length += extra
+    if terms:
+        queries.append(terms)
+    return queries
+
+##Bulk version of libris_isbn_search: the ISBNs are packed into OR queries of at most querylimit characters (default: LIBRIS_QUERY_LIMIT),
+##the results of each query are paged through (n/start, pagesize records per page) and the records are mapped back
+##to the searched ISBNs via their ISBN-10 and ISBN-13 forms; at most workers queries are sent to Libris at the same time
+##Returns a dict: ISBN as given -> list of Libris records (empty if not found), None if the query of the ISBN failed
+def libris_isbn_bulk_search(isbns,headers={},proxies={},timeout=None,workers=4,querylimit=None,pagesize=None):
+    querylimit = querylimit or LIBRIS_QUERY_LIMIT
+    pagesize = pagesize or LIBRIS_PAGE_SIZE
+    isbns = [isbn for isbn in isbns if isbn]
+    canonical = {isbn: isbn.replace('-','').replace(' ','') for isbn in isbns}
+    priority = current_priority()
+    def search(terms):
+        with scheduling_priority(priority):
+            return search_query(terms)
+    def search_query(terms):
+        byform = {}
+        for isbn in terms:
+            for form in isbn_forms(isbn):
+                byform.setdefault(form, []).append(isbn)
+        found = {isbn: [] for isbn in terms}
+        query = urllib.parse.quote(" OR ".join("ISBN:" + isbn for isbn in terms))
+        TheClient = BibAPI()
+        start = 1
+        while True:
+            try:
+                res = TheClient.libris(params={"query": query, "n": str(pagesize), "start": str(start)}, headers=headers, proxies=proxies, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                res = str(e)
+            if not isinstance(res, dict) or "xsearch" not in res:
+                print("WARNING: Libris bulk search failed (" + str(getattr(TheClient.lastresponse, 'status_code', '')) + ") for " + str(len(terms)) + " ISBNs, treated as not found")
+                return {isbn: None for isbn in terms}
+            records = safe_access(res, ["xsearch", "list"], [])
+            for record in records:
+                for isbn in set(i for form in libris_record_isbns(record) for i in byform.get(form, [])):
+                    found[isbn].append(record)
+            total = int(safe_access(res, ["xsearch", "records"], 0))
+            start += pagesize
+            if not records or start > total:
+                return found
+    results = {}
+    queries = libris_isbn_queries(list(dict.fromkeys(canonical.values())), querylimit)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(queries)))) as executor:
+        for found in executor.map(search, queries):
+            results.update(found)
+    return {isbn: results[canonical[isbn]] for isbn in isbns}
+
 def journal_has_apc(invar):
     TheClient = BibAPI()
     rec = {}
@@ -464,6 +1151,29 @@ def overton_policy_citations(doi):
     res = TheClient.overton(path="documents.php",params={"plain_dois_cited": doi})
     return (safe_access(res,['query','total_results'],0),len(safe_access(res,['facets','sources'],[])))
 
+##Bulk version of overton_policy_citations: one request per DOI (several DOIs in one plain_dois_cited are not a documented
+##feature of the Overton API, and its documents cannot be reliably attributed to the DOIs they cite), at most workers requests
+##being sent to Overton at the same time; the counts are read from query.total_results and facets.sources like overton_policy_citations
+##Returns a dict: DOI as given -> (number of policy documents citing it, number of distinct sources), None if its request failed
+def overton_policy_citations_bulk(dois,workers=4,headers={},proxies={},timeout=None):
+    dois = [doi for doi in dict.fromkeys(dois) if doi]
+    priority = current_priority()
+    def search(doi):
+        with scheduling_priority(priority):
+            TheClient = BibAPI()
+            try:
+                res = TheClient.overton(path="documents.php", params={"plain_dois_cited": doi}, headers=headers, proxies=proxies, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                res = str(e)
+            if not isinstance(res, dict) or "query" not in res:
+                print("WARNING: Overton search failed (" + str(getattr(TheClient.lastresponse, 'status_code', '')) + ") for " + doi + ", treated as unknown")
+                return None
+            return (safe_access(res, ['query', 'total_results'], 0), len(safe_access(res, ['facets', 'sources'], [])))
+    if not dois:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(dois)))) as executor:
+        return dict(zip(dois, executor.map(search, dois)))
+
 def openapc_price(doi):
     TheClient = BibAPI()
     res = TheClient.openapc(path="cube/openapc/facts",params={"cut": "doi:"+doi.lower()})
@@ -5,49 +5,252 @@
 ### FORMAT CHECK ###
 import re
 
+##Regular expressions of the predefined identifier types
+#DOI_REGEXP = r'\b(10.\d{4,}(\/|%2F)(?:(?!["&\' ,<>#?{}^\[\]`|+%])\S|(%[\da-fA-F]{2,2}))+)' #strict (exclude non-compliance to recommended encoding, ref: https://www.doi.org/doi_handbook/2_Numbering.html#2.5.2.4)
+DOI_REGEXP = r'\b(10.\d{4,}(\/|%2F)(?:(?![" #?%])\S|(%[\da-fA-F]{2,2}))+)' #permissive (exclude non-compliance to mandatory encoding only, same ref)
+ISBN_REGEXP = r'\b(\d[- ]*){12}\d|\b(\d[- ]*){9}[\dxX]\b'
+ISSN_REGEXP = r'\b\d{4}-\d{3}[\dxX]\b'
+PMID_REGEXP = r'\b\d+\b'
+SCOPUSID_REGEXP = r'2-s2\.0-\d{10,12}'
+UT_REGEXP = r'A19\d{2}[A-Z\d]{5}\d{5}|00\d{13}'
+#In free text, any number matches PMID_REGEXP: PMIDs are only extracted from running text when labelled as such
+PMID_CONTEXT_REGEXP = r'(?:\bPMID:?\s*|\bpubmed/|\bPubMed ID:?\s*)(?P<pmid>\d{1,9})\b'
+
 ##Attempts to recognize an identifier string
 ##Returns the recognized identifier or an empty string ifthe format is wrong
 ##Online check possible by providing an online method, see examples below
-##Predefined types supported: DOI, ISBN, ISSN, PMID, Scopus ID (EID), UT (aka ISI)
+##Predefined types supported: DOI, ISBN, ISSN, PMID, Scopus ID (EID), UT (aka ISI), see IDENTIFIER_TYPES
 def fix_identifier(ustring,idtype=None,online_method=None,checksum=True,regexp=None,headers={},proxies={},timeout=None):
-    idtype = str(idtype)
-    do_check_digit = False
+    profiler = PROFILER
+    if profiler is not None:
+        t0 = profiler.clock()
     check_digit_method = None
     if regexp:
         #Passing regexp in argument overrides the predefined regular expressions
-        pass
-    elif idtype.lower() == 'doi':
-        #regexp = r'\b(10.\d{4,}(\/|%2F)(?:(?!["&\' ,<>#?{}^\[\]`|+%])\S|(%[\da-fA-F]{2,2}))+)' #strict (exclude non-compliance to recommended encoding, ref: https://www.doi.org/doi_handbook/2_Numbering.html#2.5.2.4)
-        regexp = r'\b(10.\d{4,}(\/|%2F)(?:(?![" #?%])\S|(%[\da-fA-F]{2,2}))+)' #permissive (exclude non-compliance to mandatory encoding only, same ref)
-    elif idtype.lower() == 'isbn':
-        regexp = r'\b(\d[- ]*){12}\d|\b(\d[- ]*){9}[\dxX]\b'
-        do_check_digit = checksum
-        check_digit_method = isbn_checkdigit
-    elif idtype.lower() == 'issn':
-        regexp = r'\b\d{4}-\d{3}[\dxX]\b'
-        do_check_digit = checksum
-        check_digit_method = issn_checkdigit
-    elif idtype.lower() == 'pmid':
-        regexp = r'\b\d+\b'
-    elif idtype.lower() == 'scopusid':
-        regexp = r'2-s2\.0-\d{10,12}'
-    elif idtype.lower() == 'ut' or idtype.lower() == 'isi':
-        regexp = r'A19\d{2}[A-Z\d]{5}\d{5}|00\d{13}'
+        match = re.search(regexp,ustring)
     else:
-        print("Unknown identifier type: " + idtype)
-        return ""
-    match = re.search(regexp,ustring)
+        idspec = IDENTIFIER_TYPES.get(str(idtype).lower())
+        if idspec is None:
+            print("Unknown identifier type: " + str(idtype))
+            return ""
+        match = idspec["regexp"].search(ustring)
+        if checksum:
+            check_digit_method = idspec["check_digit"]
+    if profiler is not None:
+        t1 = t2 = t3 = profiler.clock()
     if match:
         the_id = match.group(0)
-        isFound = not do_check_digit or check_digit_method(the_id)
+        isFound = not check_digit_method or check_digit_method(the_id)
+        if profiler is not None:
+            t2 = t3 = profiler.clock()
         if isFound and online_method:
-            online_res = online_method(the_id,headers=headers,proxies=proxies,timeout=timeout)
+            online_res = cached_online_check(online_method,idtype,the_id,headers=headers,proxies=proxies,timeout=timeout)
             if not online_res:
                 isFound = False
+            if profiler is not None:
+                t3 = profiler.clock()
+        if profiler is not None:
+            profiler.record(idtype if not regexp else 'regexp', True, t1-t0, t2-t1, t3-t2)
         return isFound*the_id
     else:
+        if profiler is not None:
+            profiler.record(idtype if not regexp else 'regexp', False, t1-t0, 0.0, 0.0)
         return ""
 
+##Opt-in profiling of fix_identifier (and therefore of all fix_... functions)
+##Records per identifier type the time spent in regular expression matching, check digit and online check
+##Example: enable_profiling(); [...]; print(profiling_report()); disable_profiling()
+#Profiling costs a few clock reads per call: it is off by default (PROFILER = None) and the format check then pays a single test
+PROFILER = None
+
+class CallProfiler:
+    """
+    Timings of fix_identifier calls, per identifier type
+     - stats(): {idtype: {"calls", "matched", "regex", "checkdigit", "online" (total seconds), "max_regex", "max_checkdigit", "max_online", "max_call" (worst single call, seconds)}}
+     - report(): the same as a text table
+    """
+    PHASES = ("regex", "checkdigit", "online")
+    def __init__(self):
+        import time
+        self.clock = time.perf_counter
+        self.lock = threading.Lock()
+        self.data = {}
+    def record(self, idtype, matched, regex, checkdigit, online):
+        idtype = str(idtype).lower()
+        with self.lock:
+            entry = self.data.get(idtype)
+            if entry is None:
+                entry = self.data[idtype] = [0, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += matched
+            for i, t in enumerate((regex, checkdigit, online)):
+                entry[2+i] += t
+                if t > entry[5+i]:
+                    entry[5+i] = t
+            total = regex + checkdigit + online
+            if total > entry[8]:
+                entry[8] = total
+    def stats(self):
+        with self.lock:
+            res = {}
+            for idtype, entry in self.data.items():
+                res[idtype] = {"calls": entry[0], "matched": entry[1]}
+                for i, phase in enumerate(self.PHASES):
+                    res[idtype][phase] = entry[2+i]
+                    res[idtype]["max_" + phase] = entry[5+i]
+                res[idtype]["max_call"] = entry[8]
+            return res
+    def reset(self):
+        with self.lock:
+            self.data = {}
+    def report(self):
+        lines = ["%-9s %9s %9s %10s %10s %10s %12s" % ("type", "calls", "matched", "regex ms", "check ms", "online ms", "max call ms")]
+        for idtype, st in sorted(self.stats().items()):
+            lines.append("%-9s %9d %9d %10.1f %10.1f %10.1f %12.3f" % (idtype, st["calls"], st["matched"], st["regex"]*1000, st["checkdigit"]*1000, st["online"]*1000, st["max_call"]*1000))
+        return "\n".join(lines)
+
+def enable_profiling():
+    global PROFILER
+    if PROFILER is None:
+        PROFILER = CallProfiler()
+    return PROFILER
+
+def disable_profiling():
+    global PROFILER
+    PROFILER = None
+
+def profiling_report():
+    if PROFILER is None:
+        return "Profiling is not enabled (see enable_profiling)"
+    return PROFILER.report()
+
+#Missing values: None, NaN and pandas.NA (nullable dtypes, e.g. after convert_dtypes()), without importing pandas
+def is_missing(value):
+    return value is None or (isinstance(value,float) and value != value) or type(value).__name__ == 'NAType'
+
+##Batch version of fix_identifier for an iterable of strings (list, generator, pandas Series...)
+##Returns a list of results aligned with the input (a Series with the same index if the input is a pandas Series)
+##Missing values (None, NaN, pandas.NA) give an empty string, other non-string values are converted with str()
+##online_check=True uses the default online method of the identifier type (see IDENTIFIER_TYPES), unless online_method is given
+def fix_identifiers(strings,idtype=None,online_check=False,online_method=None,checksum=True,regexp=None,headers={},proxies={},timeout=None):
+    check_digit_method = None
+    if regexp:
+        search = re.compile(regexp).search
+    else:
+        idspec = IDENTIFIER_TYPES.get(str(idtype).lower())
+        if idspec is None:
+            print("Unknown identifier type: " + str(idtype))
+            return fix_identifiers_output(strings,["" for s in strings])
+        search = idspec["regexp"].search
+        if checksum:
+            check_digit_method = idspec["check_digit"]
+        if online_check and not online_method:
+            online_method = idspec["online_method"]
+    results = []
+    append = results.append
+    for ustring in strings:
+        if type(ustring) is not str:
+            if is_missing(ustring):
+                append("")
+                continue
+            ustring = str(ustring)
+        match = search(ustring)
+        if match is None:
+            append("")
+            continue
+        the_id = match.group(0)
+        if check_digit_method and not check_digit_method(the_id):
+            append("")
+        elif online_method and not cached_online_check(online_method,idtype,the_id,headers=headers,proxies=proxies,timeout=timeout):
+            append("")
+        else:
+            append(the_id)
+    return fix_identifiers_output(strings,results)
+
+#Gives the results the same container type as the input for pandas Series (without importing pandas)
+def fix_identifiers_output(strings,results):
+    if type(strings).__name__ == 'Series' and hasattr(strings,'index'):
+        return type(strings)(results,index=strings.index,name=strings.name)
+    return results
+
+
+##Finds all the identifiers of the given types (default: all predefined types) in a text, scanning it only once
+##Yields tuples (idtype, identifier, (start, end), valid) in order of appearance
+##valid is the result of the check digit function (ISBN, ISSN), None for types without check digit or if checksum=False
+##Types are tried in the order doi, scopusid, ut, isbn, issn, pmid at each position, so that e.g. the digits of a DOI or UT are not also reported as an ISBN;
+##a candidate with a wrong check digit gives way to a valid identifier of the next types at the same position (see extraction_matches)
+def extract_identifiers(ustring,idtypes=None,checksum=True,only_valid=False):
+    for match, idtype, the_id, valid in extraction_matches(ustring,extraction_key(idtypes),checksum=checksum):
+        if only_valid and valid is False:
+            continue
+        yield (idtype, the_id, match.span(idtype), valid)
+
+#Combined regular expressions used by extract_identifiers, compiled once per set of identifier types
+EXTRACTION_ORDER = ['doi', 'scopusid', 'ut', 'isbn', 'issn', 'pmid']
+EXTRACTION_PATTERNS = {}
+
+#Requested identifier types (default: all) in extraction order, as a tuple
+def extraction_key(idtypes=None):
+    if idtypes is None:
+        idtypes = EXTRACTION_ORDER
+    elif isinstance(idtypes,str):
+        idtypes = [idtypes]
+    idtypes = ['ut' if t.lower() == 'isi' else t.lower() for t in idtypes]
+    key = tuple(t for t in EXTRACTION_ORDER if t in idtypes)
+    if key not in EXTRACTION_PATTERNS:
+        for t in idtypes:
+            if t not in EXTRACTION_ORDER:
+                print("Unknown identifier type: " + t)
+    return key
+
+def extraction_pattern(idtypes=None):
+    key = idtypes if isinstance(idtypes,tuple) else extraction_key(idtypes)
+    if key not in EXTRACTION_PATTERNS:
+        alternatives = []
+        for t in key:
+            if t == 'pmid':
+                alternatives.append(PMID_CONTEXT_REGEXP)
+            else:
+                alternatives.append('(?P<' + t + '>' + IDENTIFIER_TYPES[t]["regexp"].pattern + ')')
+        EXTRACTION_PATTERNS[key] = re.compile('|'.join(alternatives) or '(?!)')
+    return EXTRACTION_PATTERNS[key]
+
+#Matches of the types of key (see extraction_key) in buf[pos:endpos] (str, bytes or mmap), in order of appearance
+#Yields (match, idtype, identifier, valid), valid being None for types without check digit or if checksum=False
+#If checksum=True, a candidate with a wrong check digit is replaced by a match of the next types of key at the same position,
+#if one is valid: in "ISSN 0028-0836 12" the ISBN-like "0028-0836 12" (wrong check digit) gives way to the ISSN 0028-0836
+def extraction_matches(buf,key,pos=0,endpos=None,checksum=True):
+    isbytes = not isinstance(buf,str)
+    compiled = extraction_pattern_bytes if isbytes else extraction_pattern
+    pattern = compiled(key)
+    if endpos is None:
+        endpos = len(buf)
+    def candidate(match):
+        idtype = match.lastgroup
+        the_id = match.group(idtype)
+        if isbytes:
+            the_id = the_id.decode('utf-8','replace')
+        check_digit_method = IDENTIFIER_TYPES[idtype]["check_digit"]
+        valid = check_digit_method(the_id) if checksum and check_digit_method else None
+        return match, idtype, the_id, valid
+    while True:
+        match = pattern.search(buf,pos,endpos)
+        if match is None:
+            return
+        found = candidate(match)
+        rest = key[key.index(found[1])+1:]
+        while found[3] is False and rest:
+            other = compiled(rest).match(buf,match.start(),endpos)
+            if other is None:
+                break
+            othercandidate = candidate(other)
+            if othercandidate[3] is not False:
+                found = othercandidate
+                break
+            rest = rest[rest.index(othercandidate[1])+1:]
+        yield found
+        pos = found[0].end()
+
 
 ##Check digit functions
 
@@ -83,100 +286,912 @@ def isbn_checkdigit(isbn):
     return isbn_canonical[-1].lower() == checkchar
 
 
+##Vectorized check digit functions (require numpy)
+##Batch versions of isbn_checkdigit/issn_checkdigit for a list, numpy array or pandas Series of strings
+##Return a numpy boolean mask aligned with the input
+##Dashes and spaces are ignored (so that e.g. ISSNs without hyphen are also accepted), other characters make the identifier invalid
+##The strings are converted, chunksize at a time, into a uint8 matrix of digits (X/x = 10) on which weighted sums are computed
+
+#ISBN-10 (weights 10..1, sum divisible by 11) and ISBN-13 (weights 1,3,1,3..., sum divisible by 10)
+def isbn_checkdigits(isbns,chunksize=2**20):
+    import numpy as np
+    isbns = np.asarray(isbns,dtype=str).reshape(-1)
+    res = np.zeros(len(isbns),dtype=bool)
+    w10 = np.append(np.arange(10,0,-1),[0]*3)
+    w13 = np.tile([1,3],7)[:13]
+    for start in range(0,len(isbns),chunksize):
+        digits, positions, ndigits, xpos, ok = digit_matrix(isbns[start:start+chunksize],13)
+        isbn10 = ok & (ndigits == 10) & ((xpos == -1) | (xpos == 9)) & ((digits * w10[positions]).sum(axis=1) % 11 == 0)
+        isbn13 = ok & (ndigits == 13) & (xpos == -1) & ((digits * w13[positions]).sum(axis=1) % 10 == 0)
+        res[start:start+chunksize] = isbn10 | isbn13
+    return res
+
+#ISSN (weights 8..1, sum divisible by 11)
+def issn_checkdigits(issns,chunksize=2**20):
+    import numpy as np
+    issns = np.asarray(issns,dtype=str).reshape(-1)
+    res = np.zeros(len(issns),dtype=bool)
+    w8 = np.arange(8,0,-1)
+    for start in range(0,len(issns),chunksize):
+        digits, positions, ndigits, xpos, ok = digit_matrix(issns[start:start+chunksize],8)
+        res[start:start+chunksize] = ok & (ndigits == 8) & ((xpos == -1) | (xpos == 7)) & ((digits * w8[positions]).sum(axis=1) % 11 == 0)
+    return res
+
+#Converts an array of strings into a uint8 matrix of digits (X/x = 10, separators = 0) with one row per string,
+#and a matrix giving the rank of each digit in its identifier (separators ignored, capped at width-1), used to look up the weights
+#Also returns the number of digits per string, the rank of the X (-1 if none)
+#and whether each string contains only digits, X, dashes and spaces with at most one X
+def digit_matrix(strings,width):
+    import numpy as np
+    n = len(strings)
+    if strings.dtype.itemsize == 0:
+        codes = np.zeros((n,1),dtype=np.uint32)
+    else:
+        codes = np.ascontiguousarray(strings).view(np.uint32).reshape(n,-1)
+    ascii = np.all(codes < 128,axis=1)
+    codes = codes.astype(np.uint8)
+    digits = codes - np.uint8(48)
+    isdigit = digits <= 9
+    isx = (codes == 88) | (codes == 120)
+    keep = isdigit | isx
+    ok = ascii & np.all(keep | (codes == 45) | (codes == 32) | (codes == 0),axis=1) & (np.count_nonzero(isx,axis=1) <= 1)
+    digits[isx] = 10
+    digits[~keep] = 0
+    #Counted on 32 bits (a uint8 count wraps around after 255 digits), the capped ranks fit in 8 bits
+    positions = np.cumsum(keep,axis=1,dtype=np.int32)
+    ndigits = positions[:,-1]
+    positions = np.minimum(positions - keep,width-1).astype(np.uint8)
+    xpos = np.where(isx,positions.astype(np.int16),-1).max(axis=1)
+    return digits, positions, ndigits, xpos, ok
+
+
 ### ONLINE CHECKS ###
-import bibapi
-import requests
-import json
+import threading
+
+#The network stack is only imported when an online check is actually used,
+#so that offline format checks (fix_... without online_check) stay cheap to import
+import importlib
+
+class LazyModule:
+    def __init__(self, name):
+        self.name = name
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.name)
+        globals()[self.name] = module
+        return getattr(module, attr)
+
+bibapi = LazyModule('bibapi')
+requests = LazyModule('requests')
 
 #Method for checking that an identifier corresponds to a correct web location
-def identifier_has_location(idstring,idtype=None,urlbase=None,headers={'User-Agent': 'Mozilla/5.0 (Windows NT 6.0; WOW64; rv:24.0) Gecko/20100101 Firefox/24.0'},proxies={},timeout=None):
+#mode="get": the whole page is downloaded; "stream": GET request closed as soon as the headers are received; "head": HEAD request
+#(falls back to "stream" if the server does not support HEAD); default: LOCATION_CHECK_DEFAULTS
+#follow_redirects=False: stops at the first answer, a redirection (e.g. from the doi.org resolver to the publisher) counts as found
+#The ISSN check needs the content of the page and always uses mode="get"
+#Connections are kept in a pool (one requests.Session per thread) and reused between calls
+def identifier_has_location(idstring,idtype=None,urlbase=None,headers={'User-Agent': 'Mozilla/5.0 (Windows NT 6.0; WOW64; rv:24.0) Gecko/20100101 Firefox/24.0'},proxies={},timeout=None,mode=None,follow_redirects=None):
     idtype = str(idtype)
-    if urlbase:
-        pass
-    elif idtype == 'doi':
-        urlbase = "doi.org"
-    elif idtype == 'issn':
-        urlbase = "portal.issn.org/resource/ISSN"
-    elif idtype == 'pmid':
-        urlbase = "www.ncbi.nlm.nih.gov/pubmed"
-    else:
-        print("Identifier type " + idtype + " not supported")
+    urlbase = urlbase or location_urlbase(idtype)
+    mode = mode or LOCATION_CHECK_DEFAULTS["mode"]
+    if follow_redirects is None:
+        follow_redirects = LOCATION_CHECK_DEFAULTS["follow_redirects"]
+    if idtype == 'issn':
+        mode = "get"
+    url = "https://" + str(urlbase) + "/" + idstring
     try:
-        req = requests.get("https://" + urlbase + "/" + idstring, headers=headers, proxies=proxies, timeout=timeout)
+        if mode == "head":
+            req = bibapi.resilient_call(session_head, url, headers=headers, proxies=proxies, timeout=timeout, allow_redirects=follow_redirects)
+            if req.status_code in [405, 501]:
+                mode = "stream"
+        if mode == "stream":
+            req = bibapi.resilient_call(session_get, url, headers=headers, proxies=proxies, timeout=timeout, allow_redirects=follow_redirects, stream=True)
+            release_connection(req)
+        elif mode != "head":
+            req = bibapi.resilient_call(session_get, url, headers=headers, proxies=proxies, timeout=timeout, allow_redirects=follow_redirects)
         if idtype == 'issn':
             isFound = (fix_issn(req.text, False) != "")
         else:
-            isFound = req.status_code == 200
+            isFound = req.status_code == 200 or (not follow_redirects and req.is_redirect)
+        if req.status_code == 429 or req.status_code >= 500:
+            note_transient_error()
     except requests.exceptions.RequestException as e:
         print('\nWARNING: "requests.get()" raised an exception for ' + idtype + ':' + idstring + ', treated as not found\nException: ' + str(e) + (proxies != {})*('\nProxies: ' + str(proxies)))
+        note_transient_error()
         isFound = False
     return isFound
 
+#Default location (host and path) of the identifiers of a type, None if the type is not supported
+def location_urlbase(idtype):
+    if idtype == 'doi':
+        return "doi.org"
+    elif idtype == 'issn':
+        return "portal.issn.org/resource/ISSN"
+    elif idtype == 'pmid':
+        return "www.ncbi.nlm.nih.gov/pubmed"
+    print("Identifier type " + str(idtype) + " not supported")
+    return None
+
+#Default options of identifier_has_location (and doi_has_content, pmid_has_content)
+#"stream" gives the same answers as "get" without downloading the pages
+LOCATION_CHECK_DEFAULTS = {"mode": "stream", "follow_redirects": True}
+
+#Bulk version of identifier_has_location: checks the identifiers concurrently, with at most per_host requests in flight per host
+#(limit shared by all concurrent bulk checks); returns a list of booleans aligned with idstrings
+def identifiers_have_location(idstrings,idtype=None,urlbase=None,headers={'User-Agent': 'Mozilla/5.0 (Windows NT 6.0; WOW64; rv:24.0) Gecko/20100101 Firefox/24.0'},proxies={},timeout=None,mode=None,follow_redirects=None,per_host=8):
+    from concurrent.futures import ThreadPoolExecutor
+    idstrings = list(idstrings)
+    semaphore = host_semaphore(str(urlbase or location_urlbase(str(idtype))).split('/')[0],per_host)
+    def check(idstring):
+        with semaphore:
+            return identifier_has_location(idstring,idtype=idtype,urlbase=urlbase,headers=headers,proxies=proxies,timeout=timeout,mode=mode,follow_redirects=follow_redirects)
+    with ThreadPoolExecutor(max_workers=max(1,min(per_host,len(idstrings)))) as executor:
+        return list(executor.map(check,idstrings))
+
+#Semaphores limiting the concurrent requests of the bulk checks, keyed by host name (e.g. doi.org)
+HOST_SEMAPHORES = {}
+
+def host_semaphore(host,limit):
+    return HOST_SEMAPHORES.setdefault(host,threading.BoundedSemaphore(limit))
+
+#Pooled connections: one requests.Session per thread
+HTTP_SESSIONS = threading.local()
+
+def http_session():
+    if not hasattr(HTTP_SESSIONS,'session'):
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16,pool_maxsize=16)
+        session.mount('https://',adapter)
+        session.mount('http://',adapter)
+        HTTP_SESSIONS.session = session
+    return HTTP_SESSIONS.session
+
+#GET and HEAD through the session of the calling thread: they can be hedged (see bibapi.Resilience),
+#each attempt running in its own thread uses its own session
+def session_get(url,**kwargs):
+    return http_session().get(url,**kwargs)
+
+def session_head(url,**kwargs):
+    return http_session().head(url,**kwargs)
+
+session_get.hedgeable = True
+session_head.hedgeable = True
+
+#A streamed response only gives its connection back to the pool if its body is read to the end:
+#bodies of at most limit bytes are drained, larger ones are closed (their connection is dropped)
+def release_connection(req,limit=65536):
+    length = req.headers.get('Content-Length','')
+    if not length.isdigit() or int(length) <= limit:
+        nbytes = 0
+        for chunk in req.iter_content(16384):
+            nbytes += len(chunk)
+            if nbytes > limit:
+                break
+    req.close()
+
 def doi_has_content(ustring,headers={},proxies={},timeout=None):
     return identifier_has_location(ustring,idtype='doi',headers=headers,proxies=proxies,timeout=timeout)
 
 def pmid_has_content(ustring,headers={},proxies={},timeout=None):
     return identifier_has_location(ustring,idtype='pmid',headers=headers,proxies=proxies,timeout=timeout)
 
+#Uses the offline ISSN registry if one is loaded (see load_issn_registry), portal.issn.org otherwise
 def issn_has_content(ustring,headers={},proxies={},timeout=None):
+    if ISSN_REGISTRY is not None:
+        if ustring in ISSN_REGISTRY:
+            return True
+        if not ISSN_REGISTRY_ONLINE_FALLBACK:
+            return False
     return identifier_has_location(ustring,idtype='issn',headers=headers,proxies=proxies,timeout=timeout)
 
 def scopusid_has_content(ustring,headers={},proxies={},timeout=None):
-    rec = bibapi.scopus_search("EID(" + ustring + ")",headers=headers,proxies=proxies,timeout=timeout)
+    TheClient = bibapi.BibAPI()
+    rec = TheClient.elsevier(path='search/scopus', params={"query": "EID(" + ustring + ")"}, apiname='scopus', headers=headers, proxies=proxies, timeout=timeout)
+    if TheClient.lastresponse.status_code == 429 or TheClient.lastresponse.status_code >= 500:
+        note_transient_error()
     nres = int(bibapi.safe_access(rec,['search-results','opensearch:totalResults'],'0'))
     return nres > 0
 
 def ut_has_content(ustring,headers={},proxies={},timeout=None):
-    rec = bibapi.wos_search("UT=" + ustring,headers=headers,proxies=proxies,timeout=timeout)
+    TheClient = bibapi.BibAPI()
+    rec = TheClient.clarivate(params={"usrQuery": "UT=" + ustring, "databaseId": "WOK"}, headers=headers, proxies=proxies, timeout=timeout)
+    if TheClient.lastresponse.status_code == 429 or TheClient.lastresponse.status_code >= 500:
+        note_transient_error()
     nres = bibapi.safe_access(rec,['QueryResult','RecordsFound'],0)
     return nres > 0
 
-def isbn_has_content(ustring,verbose=False,headers={'User-Agent': 'Mozilla/5.0 (Windows NT 6.0; WOW64; rv:24.0) Gecko/20100101 Firefox/24.0'},proxies={},timeout=None):
+##ISBN online check, via the sources of ISBN_SOURCES
+##mode="sequential": sources queried one after the other until one finds the ISBN (default, see ISBN_CHECK_DEFAULTS)
+##mode="race": all sources queried concurrently, the first positive answer is returned and the sources not yet started are cancelled
+##mode="staggered": like "race", but each source is only started after stagger seconds (or as soon as the previous ones answered negatively)
+##deadline: overall time budget in seconds (None: no limit), the ISBN is treated as not found when it is exceeded
+##adaptive=True: sources ordered by observed success rate per second of latency (see isbn_source_stats) instead of the ISBN_SOURCES order
+def isbn_has_content(ustring,verbose=False,headers={'User-Agent': 'Mozilla/5.0 (Windows NT 6.0; WOW64; rv:24.0) Gecko/20100101 Firefox/24.0'},proxies={},timeout=None,mode=None,deadline=None,stagger=None,adaptive=None):
     #Special case of an empty string (some services can return a false positive)
     if not(ustring):
         return False
+    mode = mode or ISBN_CHECK_DEFAULTS["mode"]
+    deadline = ISBN_CHECK_DEFAULTS["deadline"] if deadline is None else deadline
+    stagger = ISBN_CHECK_DEFAULTS["stagger"] if stagger is None else stagger
+    adaptive = ISBN_CHECK_DEFAULTS["adaptive"] if adaptive is None else adaptive
     isbncand = ustring.replace('-','').replace(' ','')
-    LocList = ["Libris","Google Books API","Open Library Book API","ISBN search","Books by ISBN"]
-    acc = 0
+    sources = isbn_source_order() if adaptive else [name for name, method in ISBN_SOURCES]
+    if mode == "sequential":
+        foundvia, errors = isbn_check_sequential(sources,isbncand,ustring,headers,proxies,timeout,deadline)
+    elif mode in ["race","staggered"]:
+        foundvia, errors = isbn_check_concurrent(sources,isbncand,ustring,headers,proxies,timeout,deadline,stagger*(mode == "staggered"))
+    else:
+        print("ERROR: in function 'isbn_has_content': the value of parameter 'mode' should be 'sequential', 'race' or 'staggered'")
+        return False
+    if not foundvia and errors:
+        note_transient_error()
+    if verbose and foundvia:
+        print("Found via " + foundvia)
+    return foundvia is not None
+
+#Default options of isbn_has_content, used when they are not given in the call (e.g. through fix_isbn)
+#source_timeout: timeout of each source in the race and staggered modes when neither timeout nor deadline is given
+ISBN_CHECK_DEFAULTS = {"mode": "sequential", "deadline": None, "stagger": 0.5, "adaptive": False, "source_timeout": 10}
+
+##Bulk version of isbn_has_content for many ISBNs (e.g. validation of a whole catalogue)
+##Libris is queried with packed OR queries (see bibapi.libris_isbn_bulk_search) instead of one query per ISBN,
+##the ISBNs not found in Libris are then checked with the other sources of ISBN_SOURCES (fallback=True), workers ISBNs at a time
+##Results are read from and written to the verification cache if one is enabled (see enable_verification_cache)
+##Returns a list of booleans aligned with isbns
+def isbns_have_content(isbns,headers={'User-Agent': 'Mozilla/5.0 (Windows NT 6.0; WOW64; rv:24.0) Gecko/20100101 Firefox/24.0'},proxies={},timeout=None,workers=4,fallback=True):
+    from concurrent.futures import ThreadPoolExecutor
+    isbns = list(isbns)
+    results = {}
+    tocheck = []
+    for isbn in dict.fromkeys(isbn for isbn in isbns if isbn):
+        cached = VERIFICATION_CACHE.get('isbn',isbn,'isbn_has_content') if VERIFICATION_CACHE is not None else None
+        if cached is not None:
+            results[isbn] = cached
+        else:
+            tocheck.append(isbn)
+    errors = {}
+    if tocheck:
+        inlibris = bibapi.libris_isbn_bulk_search(tocheck,headers=headers,proxies=proxies,timeout=timeout,workers=workers)
+        stats = ISBN_SOURCE_STATS.get("Libris")
+        for isbn in tocheck:
+            records = inlibris[isbn]
+            results[isbn] = bool(records)
+            errors[isbn] = records is None
+            if stats is not None:
+                with ISBN_SOURCE_STATS_LOCK:
+                    stats["calls"] += 1
+                    stats["found"] += bool(records)
+                    stats["errors"] += records is None
+    missing = [isbn for isbn in tocheck if not results[isbn]]
+    if fallback and missing:
+        sources = [name for name in (isbn_source_order() if ISBN_CHECK_DEFAULTS["adaptive"] else [name for name, method in ISBN_SOURCES]) if name != "Libris"]
+        def check(isbn):
+            return isbn_check_sequential(sources,isbn.replace('-','').replace(' ',''),isbn,headers,proxies,timeout,ISBN_CHECK_DEFAULTS["deadline"])
+        with ThreadPoolExecutor(max_workers=max(1,min(workers,len(missing)))) as executor:
+            for isbn, (foundvia, sourceerrors) in zip(missing,executor.map(check,missing)):
+                results[isbn] = foundvia is not None
+                errors[isbn] = errors[isbn] or sourceerrors
+    if VERIFICATION_CACHE is not None:
+        for isbn in tocheck:
+            #Negative answers are not cached when a source could not be queried
+            if results[isbn] or not errors[isbn]:
+                VERIFICATION_CACHE.set('isbn',isbn,'isbn_has_content',results[isbn])
+    return [results.get(isbn,False) for isbn in isbns]
+
+#Each source takes the ISBN without dashes and spaces and returns True if it is found, False if not, None if the answer is unreliable (HTTP 429/5xx...)
+def isbn_in_libris(isbncand,headers={},proxies={},timeout=None):
+    return bibapi.safe_access(bibapi.libris_isbn_search(isbncand, headers=headers, proxies=proxies, timeout=timeout),["xsearch","records"],0) > 0
+
+def isbn_in_google_books(isbncand,headers={},proxies={},timeout=None):
+    req = bibapi.resilient_call(requests.get, "https://www.googleapis.com/books/v1/volumes?q=isbn:" + isbncand, headers=headers, proxies=proxies, timeout=timeout)
+    return req.json()["totalItems"] > 0
+
+def isbn_in_open_library(isbncand,headers={},proxies={},timeout=None):
+    req = bibapi.resilient_call(requests.get, "https://openlibrary.org/api/books?bibkeys=ISBN:" + isbncand + "&format=json", headers=headers, proxies=proxies, timeout=timeout)
+    return len(req.json()) > 0
+
+def isbn_in_isbnsearch(isbncand,headers={},proxies={},timeout=None):
+    req = bibapi.resilient_call(requests.get, "https://isbnsearch.org/isbn/" + isbncand, headers=headers, proxies=proxies, timeout=timeout)
+    if req.status_code not in [200, 404]:
+        return None
+    return req.status_code == 200
+
+def isbn_in_books_by_isbn(isbncand,headers={},proxies={},timeout=None):
+    req = bibapi.resilient_call(requests.get, "https://www.books-by-isbn.com/" + isbncand, headers=headers, proxies=proxies, timeout=timeout)
+    if req.status_code not in [200, 404]:
+        return None
+    return (req.status_code == 200) and ("No page yet on ISBN" not in req.text)
+
+ISBN_SOURCES = [("Libris", isbn_in_libris),
+                    ("Google Books API", isbn_in_google_books),
+                    ("Open Library Book API", isbn_in_open_library),
+                    ("ISBN search", isbn_in_isbnsearch),
+                    ("Books by ISBN", isbn_in_books_by_isbn)]
+
+#Per-source statistics: number of calls, number of positive answers, number of errors, average latency (exponentially weighted)
+#(updated by the threads of the concurrent modes and of isbns_have_content, under ISBN_SOURCE_STATS_LOCK)
+ISBN_SOURCE_STATS = {name: {"calls": 0, "found": 0, "errors": 0, "latency": None} for name, method in ISBN_SOURCES}
+ISBN_SOURCE_STATS_LOCK = threading.Lock()
+
+def isbn_source_stats():
+    with ISBN_SOURCE_STATS_LOCK:
+        return {name: dict(stats) for name, stats in ISBN_SOURCE_STATS.items()}
+
+#Sources sorted by expected positive answers per second, with a prior of 1 success out of 2 calls in 1 second
+def isbn_source_order():
+    snapshot = isbn_source_stats()
+    def score(name):
+        stats = snapshot[name]
+        latency = stats["latency"] if stats["latency"] is not None else 1.0
+        return (stats["found"] + 1)/(stats["calls"] + 2)/max(latency,0.001)
+    return sorted([name for name, method in ISBN_SOURCES],key=score,reverse=True)
+
+#Queries one source, records its statistics and returns True if the ISBN is found, False if not, None in case of error
+def isbn_query_source(name,isbncand,ustring,headers,proxies,timeout):
+    import time
+    method = dict(ISBN_SOURCES)[name]
+    stats = ISBN_SOURCE_STATS[name]
+    t0 = time.monotonic()
     try:
-        isFound = (bibapi.safe_access(bibapi.libris_isbn_search(isbncand, headers=headers, proxies=proxies, timeout=timeout),["xsearch","records"],0) > 0)
+        isFound = method(isbncand,headers=headers,proxies=proxies,timeout=timeout)
+        if isFound is None:
+            print('\nWARNING: ' + name + ' service gave no reliable answer for isbn:' + ustring + ', treated as not found')
+        else:
+            isFound = bool(isFound)
     except requests.exceptions.RequestException as e:
         print('\nWARNING: "requests.get()" raised an exception for isbn:' + ustring + ', treated as not found\nException: ' + str(e) + (proxies != {})*('\nProxies: ' + str(proxies)))
-        isFound = False
-    if not isFound:
-        acc += 1
-        try:
-            req = requests.get("https://www.googleapis.com/books/v1/volumes?q=isbn:" + isbncand, headers=headers, proxies=proxies, timeout=timeout)
-            isFound = req.json()["totalItems"] > 0
-        except requests.exceptions.RequestException as e:
-            print('\nWARNING: "requests.get()" raised an exception for isbn:' + ustring + ', treated as not found\nException: ' + str(e) + (proxies != {})*('\nProxies: ' + str(proxies)))
-    if not isFound:
-        acc += 1
-        try:
-            req = requests.get("https://openlibrary.org/api/books?bibkeys=ISBN:" + isbncand + "&format=json", headers=headers, proxies=proxies, timeout=timeout)
-            isFound = len(req.json()) > 0
-        except requests.exceptions.RequestException as e:
-            print('\nWARNING: "requests.get()" raised an exception for isbn:' + ustring + ', treated as not found\nException: ' + str(e) + (proxies != {})*('\nProxies: ' + str(proxies)))
-        except ValueError:
-            print('\nWARNING: Open Library service appears to be offline for isbn:' + ustring + ', treated as not found')
-    if not isFound:
-        acc += 1
-        try:
-            req = requests.get("https://isbnsearch.org/isbn/" + isbncand, headers=headers, proxies=proxies, timeout=timeout)
-            isFound = req.status_code == 200
-        except requests.exceptions.RequestException as e:
-            print('\nWARNING: "requests.get()" raised an exception for isbn:' + ustring + ', treated as not found\nException: ' + str(e) + (proxies != {})*('\nProxies: ' + str(proxies)))
-    if not isFound:
-        acc += 1
-        try:
-            req = requests.get("https://www.books-by-isbn.com/" + isbncand, headers=headers, proxies=proxies, timeout=timeout)
-            isFound = (req.status_code == 200) and ("No page yet on ISBN" not in req.text)
-        except requests.exceptions.RequestException as e:
-            print('\nWARNING: "requests.get()" raised an exception for isbn:' + ustring + ', treated as not found\nException: ' + str(e) + (proxies != {})*('\nProxies: ' + str(proxies)))
-    if verbose and isFound:
-        print("Found via " + LocList[acc])
+        isFound = None
+    except (ValueError, KeyError, TypeError):
+        print('\nWARNING: ' + name + ' service appears to be offline for isbn:' + ustring + ', treated as not found')
+        isFound = None
+    latency = time.monotonic() - t0
+    with ISBN_SOURCE_STATS_LOCK:
+        stats["calls"] += 1
+        stats["found"] += bool(isFound)
+        stats["errors"] += (isFound is None)
+        stats["latency"] = latency if stats["latency"] is None else 0.8*stats["latency"] + 0.2*latency
     return isFound
 
+#Remaining time before the deadline, used as timeout (capped by the timeout given by the user)
+def isbn_timeout(timeout,end):
+    import time
+    if end is None:
+        return timeout
+    return bibapi.cap_timeout(timeout,max(end - time.monotonic(),0.001))
+
+#Return the name of the first source that found the ISBN (None if none did)
+#and whether the answer may be a false negative (error or exceeded deadline)
+def isbn_check_sequential(sources,isbncand,ustring,headers,proxies,timeout,deadline):
+    import time
+    end = time.monotonic() + deadline if deadline else None
+    errors = False
+    for name in sources:
+        if end is not None and time.monotonic() >= end:
+            return None, True
+        res = isbn_query_source(name,isbncand,ustring,headers,proxies,isbn_timeout(timeout,end))
+        if res:
+            return name, errors
+        errors = errors or res is None
+    return None, errors
+
+ISBN_EXECUTOR = None
+
+def isbn_check_concurrent(sources,isbncand,ustring,headers,proxies,timeout,deadline,stagger):
+    import time
+    import threading
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    global ISBN_EXECUTOR
+    if ISBN_EXECUTOR is None:
+        ISBN_EXECUTOR = ThreadPoolExecutor(max_workers=4*len(ISBN_SOURCES))
+    end = time.monotonic() + deadline if deadline else None
+    if end is None and not timeout:
+        #The sources still running after the answer are not waited for, but they must not hold a thread forever
+        timeout = ISBN_CHECK_DEFAULTS["source_timeout"]
+    finished = threading.Event()
+    def query(name):
+        #Sources not started before the end of the race are skipped
+        if finished.is_set():
+            return False
+        return isbn_query_source(name,isbncand,ustring,headers,proxies,isbn_timeout(timeout,end))
+    futures = {}
+    nextsource = 0
+    nextstart = time.monotonic()
+    errors = False
+    try:
+        while True:
+            now = time.monotonic()
+            while nextsource < len(sources) and now >= nextstart:
+                futures[ISBN_EXECUTOR.submit(query,sources[nextsource])] = sources[nextsource]
+                nextsource += 1
+                nextstart = now + stagger
+            pending = [f for f in futures if not f.done()]
+            done = [f for f in futures if f.done()]
+            for f in done:
+                if f.result():
+                    return futures[f], errors
+                errors = errors or f.result() is None
+                del futures[f]
+            if done and stagger > 0:
+                #A negative answer starts the next source without waiting for the stagger delay
+                nextstart = now
+                continue
+            if not pending and nextsource >= len(sources):
+                return None, errors
+            if end is not None and now >= end:
+                return None, True
+            waittime = None
+            if nextsource < len(sources):
+                waittime = max(nextstart - now,0)
+            if end is not None:
+                waittime = min(waittime if waittime is not None else end - now,end - now)
+            wait(pending,timeout=waittime,return_when=FIRST_COMPLETED)
+    finally:
+        finished.set()
+        for f in futures:
+            f.cancel()
+
+#Same check as bibapi.doi_handle, returning a boolean and noting server errors as transient (see VerificationCache)
+#DOIs found in the DOI filter (see load_doi_filter) are accepted without online check
+#DOIs with an invalid prefix are rejected without online check if a prefix registry is loaded (see load_doi_prefixes)
+def doi_has_handle(ustring,headers={},proxies={},timeout=None):
+    if DOI_FILTER is not None and ustring in DOI_FILTER:
+        return True
+    if DOI_PREFIXES is not None:
+        prefixok = DOI_PREFIXES.check(doi_prefix(ustring),headers=headers,proxies=proxies,timeout=timeout)
+        if prefixok is False:
+            return False
+        if prefixok and DOI_PREFIXES.accept_known:
+            return True
+    TheClient = bibapi.BibAPI()
+    res = TheClient.doi(path=ustring, params={"type": "URL"}, headers=headers, proxies=proxies, timeout=timeout)
+    if TheClient.lastresponse.status_code == 429 or TheClient.lastresponse.status_code >= 500:
+        note_transient_error()
+    isFound = str(bibapi.safe_access(res, ["values", 0, "data","value"],"")) != ""
+    if isFound and DOI_PREFIXES is not None:
+        DOI_PREFIXES.learn(doi_prefix(ustring),True)
+    return isFound
+
+#Bulk version of doi_has_handle: DOIs are grouped by prefix, each unknown prefix is checked once (if a prefix registry is loaded)
+#and the DOIs of invalid prefixes are rejected; the other DOIs are checked concurrently with at most per_host requests in flight
+#Results are read from and written to the verification cache if one is enabled (see enable_verification_cache), like fix_doi(..., online_check=True)
+#Returns a list of booleans aligned with dois
+def dois_have_handle(dois,headers={},proxies={},timeout=None,per_host=8):
+    from concurrent.futures import ThreadPoolExecutor
+    dois = list(dois)
+    results = [False]*len(dois)
+    byprefix = {}
+    for i, doi in enumerate(dois):
+        cached = VERIFICATION_CACHE.get('doi',doi,'doi_has_handle') if VERIFICATION_CACHE is not None else None
+        if cached is not None:
+            results[i] = cached
+        else:
+            byprefix.setdefault(doi_prefix(doi),[]).append(i)
+    semaphore = host_semaphore("doi.org",per_host)
+    #The scheduling priority of the caller is thread-local, the worker threads take it over
+    priority = bibapi.current_priority()
+    def check(function,arg):
+        with semaphore, bibapi.scheduling_priority(priority):
+            return function(arg,headers=headers,proxies=proxies,timeout=timeout)
+    #Negative answers are only cached if no transient error occurred (counted per thread, see note_transient_error)
+    def check_doi(doi):
+        nerrors = transient_error_count()
+        isFound = check(doi_has_handle,doi)
+        if VERIFICATION_CACHE is not None and (isFound or transient_error_count() == nerrors):
+            VERIFICATION_CACHE.set('doi',doi,'doi_has_handle',isFound)
+        return isFound
+    with ThreadPoolExecutor(max_workers=per_host) as executor:
+        if DOI_PREFIXES is not None:
+            prefixes = list(byprefix)
+            for prefix, prefixok in zip(prefixes,executor.map(lambda p: check(DOI_PREFIXES.check,p),prefixes)):
+                if prefixok is False:
+                    if VERIFICATION_CACHE is not None:
+                        for i in byprefix[prefix]:
+                            VERIFICATION_CACHE.set('doi',dois[i],'doi_has_handle',False)
+                    del byprefix[prefix]
+        tocheck = [i for indexes in byprefix.values() for i in indexes]
+        for i, isFound in zip(tocheck,executor.map(lambda i: check_doi(dois[i]),tocheck)):
+            results[i] = isFound
+    return results
+
+### VERIFICATION CACHE ###
+#Online checks note errors that make a negative answer unreliable (network errors, HTTP 429/5xx, exceeded deadlines)
+#so that such answers are not stored in the cache
+ONLINE_CHECK_ERRORS = threading.local()
+
+def note_transient_error():
+    ONLINE_CHECK_ERRORS.count = getattr(ONLINE_CHECK_ERRORS,'count',0) + 1
+
+def transient_error_count():
+    return getattr(ONLINE_CHECK_ERRORS,'count',0)
+
+class VerificationCache:
+    """
+    Persistent cache of online check results, stored in an SQLite file that can be shared by several processes
+     - key: (identifier type, canonical identifier, check kind = name of the online method)
+     - positive and negative results expire after positive_ttl and negative_ttl seconds respectively
+    """
+    def __init__(self, path, positive_ttl=30*86400, negative_ttl=86400):
+        self.path = path
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pid = None
+    def connect(self):
+        return bibapi.sqlite_connection(self, "CREATE TABLE IF NOT EXISTS checks (idtype TEXT, id TEXT, kind TEXT, result INTEGER, checked REAL, PRIMARY KEY (idtype, id, kind))")
+    def get(self, idtype, the_id, kind):
+        import time
+        with self.lock:
+            row = self.connect().execute("SELECT result, checked FROM checks WHERE idtype=? AND id=? AND kind=?", (idtype, canonical_cache_id(idtype, the_id), kind)).fetchone()
+            if row is not None and time.time() - row[1] < (self.positive_ttl if row[0] else self.negative_ttl):
+                self.hits += 1
+                return bool(row[0])
+            self.misses += 1
+            return None
+    def set(self, idtype, the_id, kind, result):
+        import time
+        with self.lock:
+            self.connect().execute("INSERT OR REPLACE INTO checks VALUES (?,?,?,?,?)", (idtype, canonical_cache_id(idtype, the_id), kind, int(bool(result)), time.time()))
+    def purge(self):
+        import time
+        with self.lock:
+            now = time.time()
+            self.connect().execute("DELETE FROM checks WHERE (result=1 AND checked<?) OR (result=0 AND checked<?)", (now - self.positive_ttl, now - self.negative_ttl))
+    def stats(self):
+        with self.lock:
+            counts = dict(self.connect().execute("SELECT result, COUNT(*) FROM checks GROUP BY result").fetchall())
+        return {"hits": self.hits, "misses": self.misses, "positive": counts.get(1, 0), "negative": counts.get(0, 0)}
+
+#Identifier form used in cache keys
+def canonical_cache_id(idtype, the_id):
+    if idtype in ['isbn', 'issn']:
+        return the_id.replace('-','').replace(' ','').upper()
+    if idtype == 'doi':
+        return doi_canonical_form(the_id)
+    return the_id.strip()
+
+#Cache used by fix_identifier/fix_identifiers and the fix_... functions (None = disabled)
+VERIFICATION_CACHE = None
+
+##Enables the verification cache for all online checks of fix_... functions
+##Default path: environment variable BIBFORMAT_VERIFICATION_CACHE, or bibformat_verification_cache.sqlite in the temporary directory
+def enable_verification_cache(path=None,positive_ttl=30*86400,negative_ttl=86400):
+    import os
+    import tempfile
+    global VERIFICATION_CACHE
+    if not path:
+        path = os.getenv('BIBFORMAT_VERIFICATION_CACHE') or os.path.join(tempfile.gettempdir(),'bibformat_verification_cache.sqlite')
+    VERIFICATION_CACHE = VerificationCache(path,positive_ttl=positive_ttl,negative_ttl=negative_ttl)
+    return VERIFICATION_CACHE
+
+def disable_verification_cache():
+    global VERIFICATION_CACHE
+    VERIFICATION_CACHE = None
+
+#Runs an online check, consulting the verification cache first if enabled
+def cached_online_check(online_method,idtype,the_id,headers={},proxies={},timeout=None):
+    if VERIFICATION_CACHE is None:
+        return online_method(the_id,headers=headers,proxies=proxies,timeout=timeout)
+    idtype = str(idtype).lower()
+    #functools.partial objects are named after the wrapped function
+    kind = getattr(online_method,'__name__',None) or getattr(getattr(online_method,'func',None),'__name__',str(online_method))
+    cached = VERIFICATION_CACHE.get(idtype,the_id,kind)
+    if cached is not None:
+        return cached
+    nerrors = transient_error_count()
+    res = online_method(the_id,headers=headers,proxies=proxies,timeout=timeout)
+    if res or transient_error_count() == nerrors:
+        VERIFICATION_CACHE.set(idtype,the_id,kind,res)
+    return res
+
+
+### OFFLINE ISSN REGISTRY ###
+#ISSNs are packed as 32-bit integers: the 7 first digits (the check digit is redundant and verified separately)
+from array import array
+from bisect import bisect_left
+
+ISSN_CHECKCHARS = '0123456789X'
+
+#Returns None if the string is not an ISSN with a correct check digit
+def issn_to_int(issn):
+    issn = issn.replace('-','').replace(' ','')
+    if len(issn) != 8 or not issn[:7].isdigit():
+        return None
+    n = int(issn[:7])
+    total = 0
+    for weight, x in zip((8,7,6,5,4,3,2), issn[:7].encode()):
+        total += weight*(x - 48)
+    if ISSN_CHECKCHARS[(11 - total % 11) % 11] != issn[7].upper():
+        return None
+    return n
+
+def int_to_issn(n):
+    digits = str(n).zfill(7)
+    checksum = (11 - sum((8-i)*int(x) for i,x in enumerate(digits)) % 11) % 11
+    return digits[:4] + '-' + digits[4:] + ('X' if checksum == 10 else str(checksum))
+
+class ISSNRegistry:
+    """
+    Offline list of registered ISSNs with their linking ISSN (ISSN-L)
+     - loaded from the ISSN-to-ISSN-L table published by the ISSN International Centre (tab-separated: ISSN, ISSN-L)
+       or from any text file with one ISSN per line (optionally followed by its ISSN-L)
+     - stored as two sorted arrays of 32-bit integers (about 8 bytes per ISSN), lookups by binary search
+     - save/load in a compact binary format for fast reloading
+    """
+    MAGIC = b'ISSNREG1'
+    def __init__(self, path=None, sep='\t'):
+        self.keys = array('I')
+        self.values = array('I')
+        if path:
+            if self.is_binary(path):
+                self.load(path)
+            else:
+                self.load_table(path, sep=sep)
+    def is_binary(self, path):
+        with open(path, 'rb') as f:
+            return f.read(len(self.MAGIC)) == self.MAGIC
+    def load_table(self, path, sep='\t'):
+        pairs = {}
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                fields = line.strip().split(sep)
+                key = issn_to_int(fields[0])
+                if key is None:
+                    #header or invalid line
+                    continue
+                value = issn_to_int(fields[1]) if len(fields) > 1 else None
+                pairs[key] = key if value is None else value
+        keys = sorted(pairs)
+        self.keys = array('I', keys)
+        self.values = array('I', [pairs[k] for k in keys])
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(len(self.keys).to_bytes(8, 'little'))
+            self.keys.tofile(f)
+            self.values.tofile(f)
+    def load(self, path):
+        with open(path, 'rb') as f:
+            f.read(len(self.MAGIC))
+            n = int.from_bytes(f.read(8), 'little')
+            self.keys = array('I')
+            self.keys.fromfile(f, n)
+            self.values = array('I')
+            self.values.fromfile(f, n)
+    def __len__(self):
+        return len(self.keys)
+    def index(self, issn):
+        key = issn_to_int(issn) if isinstance(issn, str) else None
+        if key is None:
+            return None
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return None
+    def __contains__(self, issn):
+        return self.index(issn) is not None
+    #Returns the ISSN-L of a registered ISSN, an empty string if the ISSN is not registered
+    def issnl(self, issn):
+        i = self.index(issn)
+        if i is None:
+            return ""
+        return int_to_issn(self.values[i])
+    def contains_many(self, issns):
+        return [self.index(issn) is not None for issn in issns]
+    def issnl_many(self, issns):
+        return [self.issnl(issn) for issn in issns]
+
+#Registry used by issn_has_content (None = online check only)
+ISSN_REGISTRY = None
+ISSN_REGISTRY_ONLINE_FALLBACK = False
+
+##Loads an ISSN registry (text table or binary file saved with ISSNRegistry.save) used by issn_has_content instead of portal.issn.org
+##online_fallback=True: ISSNs not found in the registry are still checked online
+def load_issn_registry(path,online_fallback=False,sep='\t'):
+    global ISSN_REGISTRY, ISSN_REGISTRY_ONLINE_FALLBACK
+    ISSN_REGISTRY = ISSNRegistry(path,sep=sep)
+    ISSN_REGISTRY_ONLINE_FALLBACK = online_fallback
+    return ISSN_REGISTRY
+
+def unload_issn_registry():
+    global ISSN_REGISTRY
+    ISSN_REGISTRY = None
+
+
+### DOI FILTER ###
+
+class DOIFilter:
+    """
+    Bloom filter of known DOIs (e.g. built from a Crossref or OpenAlex DOI dump), to skip the online check of DOIs known to exist
+     - no false negatives, false positives with probability error_rate for a filter filled up to its capacity
+     - about 1.2 bytes per DOI for error_rate=0.01 (1.8 bytes for 0.001)
+     - DOIs are compared case-insensitively
+     - saved in a binary file, which is memory-mapped when loaded (read-only)
+    """
+    MAGIC = b'DOIBLOOM'
+    def __init__(self, capacity=1000000, error_rate=0.01, path=None):
+        import math
+        self.mmap = None
+        if path:
+            self.load(path)
+            return
+        self.nbits = max(8, int(math.ceil(-capacity*math.log(error_rate)/math.log(2)**2)))
+        self.nhashes = max(1, int(round(self.nbits/capacity*math.log(2))))
+        self.count = 0
+        self.bits = bytearray((self.nbits + 7)//8)
+    def positions(self, doi):
+        from hashlib import blake2b
+        digest = blake2b(doi.strip().lower().encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        nbits = self.nbits
+        return [(h1 + i*h2) % nbits for i in range(self.nhashes)]
+    def add(self, doi):
+        bits = self.bits
+        for pos in self.positions(doi):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+    def update(self, dois):
+        for doi in dois:
+            self.add(doi)
+    def __contains__(self, doi):
+        bits = self.bits
+        for pos in self.positions(doi):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+    def contains_many(self, dois):
+        return [doi in self for doi in dois]
+    def __len__(self):
+        return self.count
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(self.nbits.to_bytes(8, 'little'))
+            f.write(self.nhashes.to_bytes(4, 'little'))
+            f.write(self.count.to_bytes(8, 'little'))
+            f.write(self.bits)
+    def load(self, path):
+        import mmap
+        with open(path, 'rb') as f:
+            if f.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError("Not a DOI filter file: " + path)
+            self.nbits = int.from_bytes(f.read(8), 'little')
+            self.nhashes = int.from_bytes(f.read(4), 'little')
+            self.count = int.from_bytes(f.read(8), 'little')
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.bits = memoryview(self.mmap)[len(self.MAGIC)+20:]
+
+##Builds a DOI filter from a text file with one DOI per line (other text on the line is ignored, see fix_doi)
+def build_doi_filter(path,capacity=None,error_rate=0.01,output=None):
+    if capacity is None:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            capacity = max(1, sum(1 for line in f))
+    doifilter = DOIFilter(capacity=capacity, error_rate=error_rate)
+    with open(path, encoding='utf-8', errors='replace') as f:
+        search = IDENTIFIER_TYPES['doi']['regexp'].search
+        for line in f:
+            match = search(line)
+            if match:
+                doifilter.add(match.group(0))
+    if output:
+        doifilter.save(output)
+    return doifilter
+
+#Filter consulted by the DOI handle check (None = disabled)
+DOI_FILTER = None
+
+##Loads a DOI filter (file saved with DOIFilter.save or built by build_doi_filter) or uses a DOIFilter object
+##fix_doi(..., online_check=True) then only checks online the DOIs that are not in the filter
+def load_doi_filter(doifilter):
+    global DOI_FILTER
+    if isinstance(doifilter, str):
+        doifilter = DOIFilter(path=doifilter)
+    DOI_FILTER = doifilter
+    return DOI_FILTER
+
+def unload_doi_filter():
+    global DOI_FILTER
+    DOI_FILTER = None
+
+
+### DOI PREFIX REGISTRY ###
+
+#Prefix (registrant code) of a DOI, e.g. 10.1364 for 10.1364/JOSA.18.000337, empty string if there is none
+def doi_prefix(doi):
+    match = DOI_PREFIX_REGEXP.match(doi.strip())
+    if match:
+        return match.group(1).lower()
+    return ""
+
+DOI_PREFIX_REGEXP = re.compile(r'(10\.[\d.]+?)(?:/|%2[fF])')
+
+class DOIPrefixRegistry:
+    """
+    Known DOI prefixes, used by doi_has_handle before the per-DOI lookup
+     - valid prefixes: preloaded from a list (one prefix per line) and learned from successful DOI handle lookups
+     - invalid prefixes: prefixes without handle at doi.org (checked once if check_unknown=True), their DOIs are rejected directly
+     - accept_known=True: DOIs with a valid prefix are accepted without per-DOI lookup (prefix-level check only)
+    """
+    def __init__(self, path=None, check_unknown=True, accept_known=False):
+        self.valid = set()
+        self.invalid = set()
+        self.check_unknown = check_unknown
+        self.accept_known = accept_known
+        self.lock = threading.Lock()
+        if path:
+            self.load(path)
+    def load(self, path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                prefix = doi_prefix(line.strip() + '/')
+                if prefix:
+                    self.valid.add(prefix)
+    #Only valid prefixes are saved (an invalid prefix may be registered later)
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for prefix in sorted(self.valid):
+                f.write(prefix + '\n')
+    def learn(self, prefix, exists):
+        if not prefix:
+            return
+        with self.lock:
+            if exists:
+                self.valid.add(prefix)
+                self.invalid.discard(prefix)
+            else:
+                self.invalid.add(prefix)
+    #Returns True (valid prefix), False (invalid prefix) or None (unknown)
+    def status(self, prefix):
+        if prefix in self.valid:
+            return True
+        if prefix in self.invalid:
+            return False
+        return None
+    #Like status, checking unknown prefixes online if check_unknown=True (errors leave the prefix unknown)
+    def check(self, prefix, headers={}, proxies={}, timeout=None):
+        if not prefix:
+            return False
+        res = self.status(prefix)
+        if res is None and self.check_unknown:
+            try:
+                res = bibapi.doi_prefix_exists(prefix, headers=headers, proxies=proxies, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                print('\nWARNING: "requests.get()" raised an exception for DOI prefix:' + prefix + ', treated as unknown\nException: ' + str(e))
+                res = None
+            if res is not None:
+                self.learn(prefix, res)
+        return res
+    def __len__(self):
+        return len(self.valid)
+
+#Prefix registry used by doi_has_handle (None = disabled)
+DOI_PREFIXES = None
+
+##Enables the DOI prefix registry, optionally preloaded from a list of prefixes (one per line)
+def load_doi_prefixes(path=None,check_unknown=True,accept_known=False):
+    global DOI_PREFIXES
+    DOI_PREFIXES = DOIPrefixRegistry(path,check_unknown=check_unknown,accept_known=accept_known)
+    return DOI_PREFIXES
+
+def unload_doi_prefixes():
+    global DOI_PREFIXES
+    DOI_PREFIXES = None
+
+
+### IDENTIFIER REGISTRY ###
+
+##Predefined identifier types: compiled regular expression, check digit function (None if there is no check digit)
+##and default online method (used by fix_identifiers with online_check=True)
+IDENTIFIER_TYPES = {"doi": {"regexp": re.compile(DOI_REGEXP), "check_digit": None, "online_method": doi_has_handle},
+                        "isbn": {"regexp": re.compile(ISBN_REGEXP), "check_digit": isbn_checkdigit, "online_method": isbn_has_content},
+                        "issn": {"regexp": re.compile(ISSN_REGEXP), "check_digit": issn_checkdigit, "online_method": issn_has_content},
+                        "pmid": {"regexp": re.compile(PMID_REGEXP), "check_digit": None, "online_method": pmid_has_content},
+                        "scopusid": {"regexp": re.compile(SCOPUSID_REGEXP), "check_digit": None, "online_method": scopusid_has_content},
+                        "ut": {"regexp": re.compile(UT_REGEXP), "check_digit": None, "online_method": ut_has_content}}
+IDENTIFIER_TYPES["isi"] = IDENTIFIER_TYPES["ut"]
+
 
 ### IDTYPE-SPECIFIC FUNCTIONS ###
 
@@ -195,7 +1210,7 @@ def fix_pmid(ustring,online_check=False,headers={},proxies={},timeout=None):
 def fix_doi(ustring,online_check=False,check_what="handle",headers={},proxies={},timeout=None):
     if online_check:
         if check_what == "handle":
-            return fix_identifier(ustring,'doi',online_method=bibapi.doi_handle,headers=headers,proxies=proxies,timeout=timeout)
+            return fix_identifier(ustring,'doi',online_method=doi_has_handle,headers=headers,proxies=proxies,timeout=timeout)
         elif check_what == "content":
             return fix_identifier(ustring,'doi',online_method=doi_has_content,headers=headers,proxies=proxies,timeout=timeout)
         else:
@@ -245,6 +1260,10 @@ def fix_ut(ustring,online_check=False,headers={},proxies={},timeout=None):
 ### OTHER USES ###
 
 ##Checks if the DOI is based on an ISBN
+##(results are kept in memory for the most recent DOIs, as deduplication calls it for every DOI)
+import functools
+
+@functools.lru_cache(maxsize=2**16)
 def doi_is_from_isbn(ustring):
     lastbit = ustring.split('/')[-1]
     return (fix_doi(ustring) != "") and (lastbit == fix_isbn(lastbit))
@@ -267,3 +1286,354 @@ def fix_rorid(ustring):
     #rorid_regexp = r'\b(?=.*[0-9])(?=.*[a-z])([0-9a-z]){9}\b'
     rorid_regexp = r'\b([0-9a-z]){9}\b' #It is actually allowed to have all characters of one type (digit or letter)
     return fix_identifier(ustring,regexp=rorid_regexp)
+
+
+### CANONICAL FORMS AND DEDUPLICATION ###
+#Canonical forms make the same identifier written in different ways compare equal:
+# - DOI: URL-decoded (%2F -> /) and lower-cased
+# - ISBN: ISBN-13 without dashes or spaces (ISBN-10 are converted)
+# - ISSN: integer made of the 7 first digits (see issn_to_int)
+# - PMID, Scopus EID, UT: recognized identifier (UT upper-cased)
+#The canonical_... functions return an empty string (None for ISSN) if no identifier is recognized
+
+def doi_canonical_form(doi):
+    import urllib.parse
+    return urllib.parse.unquote(doi).lower()
+
+def canonical_doi(ustring):
+    doi = fix_doi(ustring)
+    return doi_canonical_form(doi) if doi else ""
+
+def isbn10_to_isbn13(isbn10):
+    core = '978' + isbn10[:9]
+    checksum = (10 - sum((1+2*(i%2))*int(x) for i,x in enumerate(core)) % 10) % 10
+    return core + str(checksum)
+
+def canonical_isbn(ustring):
+    isbn = fix_isbn(ustring).replace('-','').replace(' ','')
+    if len(isbn) == 10:
+        return isbn10_to_isbn13(isbn)
+    return isbn
+
+#ISSN written with or without dash (1477-5751, 14775751) are read directly, other strings are recognized with fix_issn
+def canonical_issn(ustring):
+    if type(ustring) is not str:
+        return None
+    n = issn_to_int(ustring.strip())
+    if n is not None:
+        return n
+    issn = fix_issn(ustring)
+    return issn_to_int(issn) if issn else None
+
+def canonical_pmid(ustring):
+    return fix_pmid(ustring)
+
+def canonical_scopusid(ustring):
+    return fix_scopusid(ustring)
+
+def canonical_ut(ustring):
+    return fix_ut(ustring.upper())
+
+CANONICALIZERS = {"doi": canonical_doi,
+                      "isbn": canonical_isbn,
+                      "issn": canonical_issn,
+                      "pmid": canonical_pmid,
+                      "scopusid": canonical_scopusid,
+                      "ut": canonical_ut,
+                      "isi": canonical_ut}
+
+def canonical_identifier(ustring,idtype):
+    return CANONICALIZERS[str(idtype).lower()](ustring)
+
+##ISBN (canonical form) on which a DOI is based, empty string if the DOI is not based on an ISBN (see doi_is_from_isbn)
+def isbn_from_doi(doi):
+    if doi_is_from_isbn(doi):
+        return canonical_isbn(doi.split('/')[-1])
+    return ""
+
+class IdentifierClusters:
+    """
+    Clusters of records sharing at least one identifier (union-find over record numbers)
+     - fields: mapping record field -> identifier type, e.g. {"DOI": "doi", "ISBN": "isbn", "EID": "scopusid", "UT": "ut"}
+     - field values can be strings or lists of strings, identifiers are compared in canonical form
+     - link_isbn_dois=True: a DOI based on an ISBN (e.g. 10.1057/978-1-137-54575-6) also links to records with that ISBN
+     - records are not stored: memory is one hash index entry per distinct identifier (keys stored as 64-bit hashes)
+       plus 8 bytes per record, and each record costs nearly constant time (union by size with path halving)
+    """
+    def __init__(self, fields, link_isbn_dois=True):
+        self.fields = fields
+        self.link_isbn_dois = link_isbn_dois
+        self.parent = array('q')
+        self.size = array('q')
+        self.index = {}
+    def keys(self, record):
+        for field, idtype in self.fields.items():
+            values = record.get(field) if isinstance(record, dict) else getattr(record, field, None)
+            if is_missing(values):
+                continue
+            if isinstance(values, str):
+                values = [values]
+            idtype = str(idtype).lower()
+            for value in values:
+                key = canonical_identifier(str(value), idtype)
+                if key or key == 0:
+                    yield hash((idtype, key))
+                    if idtype == 'doi' and self.link_isbn_dois:
+                        isbn = isbn_from_doi(key)
+                        if isbn:
+                            yield hash(('isbn', isbn))
+    ##Adds a record and returns its number (order of addition, starting at 0)
+    def add(self, record):
+        n = len(self.parent)
+        self.parent.append(n)
+        self.size.append(1)
+        index = self.index
+        for key in self.keys(record):
+            other = index.get(key)
+            if other is None:
+                index[key] = n
+            else:
+                self.union(n, other)
+        return n
+    def update(self, records):
+        for record in records:
+            self.add(record)
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    def union(self, i, j):
+        i = self.find(i)
+        j = self.find(j)
+        if i == j:
+            return
+        if self.size[i] < self.size[j]:
+            i, j = j, i
+        self.parent[j] = i
+        self.size[i] += self.size[j]
+    ##Cluster label of each record (the smallest record number of its cluster), aligned with the order of addition
+    def labels(self):
+        smallest = {}
+        roots = [self.find(i) for i in range(len(self.parent))]
+        for i, root in enumerate(roots):
+            smallest.setdefault(root, i)
+        return [smallest[root] for root in roots]
+    ##Lists of record numbers of the clusters with more than one record (duplicates)
+    def duplicates(self):
+        clusters = {}
+        for i, label in enumerate(self.labels()):
+            clusters.setdefault(label, []).append(i)
+        return [members for members in clusters.values() if len(members) > 1]
+    def __len__(self):
+        return len(self.parent)
+
+##Deduplicates a stream of records (dicts, namedtuples, or a pandas DataFrame), see IdentifierClusters
+##Returns the cluster label of each record (the number of the first record of its cluster), aligned with the input
+def cluster_records(records,fields,link_isbn_dois=True):
+    clusters = IdentifierClusters(fields, link_isbn_dois=link_isbn_dois)
+    if hasattr(records, 'itertuples'):
+        #pandas DataFrame: rows read one at a time as dicts restricted to the identifier fields
+        columns = [col for col in fields if col in records.columns]
+        records = (dict(zip(columns, row)) for row in records[columns].itertuples(index=False, name=None))
+    clusters.update(records)
+    return clusters.labels()
+
+
+### SCANNING OF LARGE FILES ###
+#Same patterns as extract_identifiers, applied to bytes so that files can be scanned through a memory map or in chunks
+#Offsets are byte offsets in the file, identifiers are decoded as UTF-8
+#Identifiers are assumed to be shorter than "overlap" bytes, the margin used at range/chunk boundaries
+
+##Scans a (large) file for identifiers without loading it in memory
+##Yields tuples (offset, idtype, identifier) in order of appearance
+##The file is memory-mapped and split into byte ranges of rangesize bytes, scanned by a pool of processes if processes > 1
+##At most 2*processes ranges are in flight, so memory stays bounded whatever the size of the file
+def scan_file(path,idtypes=None,processes=1,rangesize=2**24,overlap=4096,only_valid=False):
+    import os
+    size = os.path.getsize(path)
+    tasks = ((path,start,min(start+rangesize,size),idtypes,overlap,only_valid) for start in range(0,size,rangesize))
+    if processes <= 1:
+        for task in tasks:
+            yield from scan_file_range(task)
+        return
+    import multiprocessing
+    from collections import deque
+    with multiprocessing.Pool(processes) as pool:
+        window = deque()
+        for task in tasks:
+            window.append(pool.apply_async(scan_file_range,(task,)))
+            if len(window) >= 2*processes:
+                yield from window.popleft().get()
+        while window:
+            yield from window.popleft().get()
+
+##Scans a binary file object (e.g. sys.stdin.buffer, a compressed stream) read in chunks of chunksize bytes
+##Yields tuples (offset, idtype, identifier) like scan_file
+def scan_stream(fileobj,idtypes=None,chunksize=2**20,overlap=4096,only_valid=False):
+    return scan_chunks(iter(lambda: fileobj.read(chunksize),b''),idtypes,overlap,only_valid)
+
+##Same as scan_stream for an iterable of byte strings (chunks of any size, e.g. the body of an HTTP response)
+def scan_chunks(chunks,idtypes=None,overlap=4096,only_valid=False):
+    key = extraction_key(idtypes)
+    chunks = iter(chunks)
+    buf = b''
+    base = 0 #file offset of buf[0]
+    scanfrom = 0
+    while True:
+        chunk = next(chunks,b'')
+        buf += chunk
+        if not chunk:
+            yield from scan_buffer(buf,key,scanfrom,0,len(buf),len(buf),base,only_valid)[0]
+            return
+        if len(buf) <= 2*overlap:
+            continue
+        #Matches starting before "limit" are complete, the rest of the buffer is carried over to the next chunk
+        limit = len(buf) - overlap
+        res, lastend = scan_buffer(buf,key,scanfrom,0,limit,len(buf),base,only_valid)
+        yield from res
+        #One byte of context is kept before the resume position for word boundaries
+        keep = max(limit,lastend) - 1
+        buf = buf[keep:]
+        base += keep
+        scanfrom = 1
+
+##Downloads a web page (e.g. a repository landing page) and scans its body as it is received, instead of
+##downloading and decoding the whole page before searching it (only the identifiers found are decoded)
+##Yields tuples (offset, idtype, identifier) like scan_stream; idtypes: default all predefined types
+##first_match=True: only the first identifier of each requested type is yielded, and the download stops
+##as soon as all requested types have been found (the rest of the page is not transferred)
+##Leaving the loop early (break) also stops the download
+def scan_url(url,idtypes=None,first_match=False,only_valid=False,chunksize=2**14,overlap=4096,headers={'User-Agent': 'Mozilla/5.0 (Windows NT 6.0; WOW64; rv:24.0) Gecko/20100101 Firefox/24.0'},proxies={},timeout=None):
+    if idtypes is None:
+        idtypes = EXTRACTION_ORDER
+    elif isinstance(idtypes,str):
+        idtypes = [idtypes]
+    wanted = set('ut' if t.lower() == 'isi' else t.lower() for t in idtypes)
+    req = bibapi.resilient_call(session_get, url, headers=headers, proxies=proxies, timeout=timeout, stream=True)
+    try:
+        for offset, idtype, the_id in scan_chunks(req.iter_content(chunksize),list(wanted),overlap,only_valid):
+            if first_match:
+                if idtype not in wanted:
+                    continue
+                wanted.discard(idtype)
+            yield (offset, idtype, the_id)
+            if first_match and not wanted:
+                return
+    finally:
+        req.close()
+
+##Equivalent of fix_identifier(requests.get(url).text, idtype) (e.g. finding the DOI of a DiVA record page) that stops the download
+##at the first identifier of the page, see scan_url (with checksum=True, ISBN/ISSN with a wrong check digit are skipped)
+##PMIDs are only recognized when labelled as such (see PMID_CONTEXT_REGEXP); returns an empty string if none is found or in case of error
+def fix_identifier_from_url(url,idtype,checksum=True,headers={'User-Agent': 'Mozilla/5.0 (Windows NT 6.0; WOW64; rv:24.0) Gecko/20100101 Firefox/24.0'},proxies={},timeout=None):
+    try:
+        for offset, foundtype, the_id in scan_url(url,[idtype],first_match=True,only_valid=checksum,headers=headers,proxies=proxies,timeout=timeout):
+            return the_id
+    except requests.exceptions.RequestException as e:
+        print('\nWARNING: "requests.get()" raised an exception for ' + url + ', treated as not found\nException: ' + str(e) + (proxies != {})*('\nProxies: ' + str(proxies)))
+    return ""
+
+EXTRACTION_PATTERNS_BYTES = {}
+
+def extraction_pattern_bytes(idtypes=None):
+    pattern = extraction_pattern(idtypes if isinstance(idtypes,tuple) else extraction_key(idtypes))
+    if pattern.pattern not in EXTRACTION_PATTERNS_BYTES:
+        EXTRACTION_PATTERNS_BYTES[pattern.pattern] = re.compile(pattern.pattern.encode())
+    return EXTRACTION_PATTERNS_BYTES[pattern.pattern]
+
+#Matches of the types of key found in buf[scanfrom:endpos] (bytes or mmap) starting in [start, end), with offsets shifted by base
+#Returns the list of (offset, idtype, identifier) and the end position in buf of the last match starting before end
+def scan_buffer(buf,key,scanfrom,start,end,endpos,base=0,only_valid=False):
+    res = []
+    lastend = 0
+    for match, idtype, the_id, valid in extraction_matches(buf,key,scanfrom,endpos):
+        if match.start() >= end:
+            break
+        lastend = match.end()
+        if match.start() < start:
+            continue
+        if only_valid and valid is False:
+            continue
+        res.append((base + match.start(idtype), idtype, the_id))
+    return res, lastend
+
+#Worker function of scan_file: scans the byte range [start, end) of a memory-mapped file
+def scan_file_range(task):
+    import mmap
+    path, start, end, idtypes, overlap, only_valid = task
+    key = extraction_key(idtypes)
+    with open(path,'rb') as f:
+        with mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as mm:
+            #The scan starts "overlap" bytes early so that a match straddling "start" (reported by the previous range)
+            #is consumed instead of being partially reported again
+            return scan_buffer(mm,key,max(0,start-overlap),start,end,min(len(mm),end+overlap),only_valid=only_valid)[0]
+
+
+### TABLES ###
+
+##Normalizes the identifier columns of a table (requires pandas)
+##table: a pandas DataFrame or the path of a CSV file; columns: mapping column name -> identifier type, e.g. {"DOI": "doi", "ISBN": "isbn"}
+##Each column is replaced by the result of fix_identifiers (written to column+suffix if suffix is given)
+##and a boolean column column+"_valid" is added
+##Rows are processed in chunks of chunksize rows, sharded across a pool of processes if processes > 1 (at most 2*processes chunks in flight)
+##For a CSV file, chunks are read and written one at a time to output (a path, required), so memory stays bounded; the output path is returned
+##For a DataFrame, the normalized DataFrame is returned
+def normalize_table(table,columns,output=None,online_check=False,checksum=True,suffix="",processes=1,chunksize=100000,sep=',',headers={},proxies={},timeout=None):
+    import pandas as pd
+    #The columns are checked once against the header, not in each chunk
+    if isinstance(table,pd.DataFrame):
+        header = table.columns
+    else:
+        header = pd.read_csv(table,sep=sep,dtype=str,nrows=0).columns
+    for col in columns:
+        if col not in header:
+            print("WARNING: column " + col + " not found, skipped")
+    columns = {col: idtype for col, idtype in columns.items() if col in header}
+    options = (columns,online_check,checksum,suffix,headers,proxies,timeout)
+    if isinstance(table,pd.DataFrame):
+        chunks = (table.iloc[start:start+chunksize] for start in range(0,len(table),chunksize))
+        results = list(normalize_chunks(chunks,options,processes))
+        if results:
+            return pd.concat(results)
+        return normalize_chunk((table,options))
+    if output is None:
+        print("ERROR: in function 'normalize_table': an output path is required for a CSV input")
+        return None
+    #Everything is read as strings so that the other columns are written back unchanged
+    #and identifiers keep their leading zeros (UT) and are not converted to floats (PMID)
+    chunks = pd.read_csv(table,sep=sep,dtype=str,keep_default_na=False,chunksize=chunksize)
+    first = True
+    for result in normalize_chunks(chunks,options,processes):
+        result.to_csv(output,sep=sep,index=False,mode='w' if first else 'a',header=first)
+        first = False
+    return output
+
+#Applies normalize_chunk to a stream of chunks, in order, in a pool of processes if processes > 1
+def normalize_chunks(chunks,options,processes=1):
+    if processes <= 1:
+        for chunk in chunks:
+            yield normalize_chunk((chunk,options))
+        return
+    import multiprocessing
+    from collections import deque
+    with multiprocessing.Pool(processes) as pool:
+        window = deque()
+        for chunk in chunks:
+            window.append(pool.apply_async(normalize_chunk,((chunk,options),)))
+            if len(window) >= 2*processes:
+                yield window.popleft().get()
+        while window:
+            yield window.popleft().get()
+
+#Worker function of normalize_table
+def normalize_chunk(task):
+    chunk, options = task
+    columns, online_check, checksum, suffix, headers, proxies, timeout = options
+    chunk = chunk.copy()
+    for col, idtype in columns.items():
+        fixed = fix_identifiers(chunk[col],idtype,online_check=online_check,checksum=checksum,headers=headers,proxies=proxies,timeout=timeout)
+        chunk[col + suffix] = fixed
+        chunk[col + "_valid"] = fixed != ""
+    return chunk
@@ -0,0 +1,339 @@
+#!/usr/bin/python
+
+#Author: Gaël Dubus / KTH Library / dubus@kth.se
+
+#Sharded harvests from the APIs of bibapi, run by any number of worker processes
+#A harvest (e.g. all OpenAlex works of an institution, or the records of a list of DOIs) is split into shards
+#(by year, by ID hash, by result range) stored as jobs in a durable queue (SQLite file)
+#Workers on one or several machines sharing the file claim jobs under a lease, write the records of each shard
+#to their own file, and the outputs are merged at the end
+#Example:
+#   queue = bibharvest.HarvestQueue('harvest.sqlite')
+#   queue.create('kth2020', 'openalex_works', bibharvest.shards_by_year(2015, 2024), {"filter": "institutions.ror:026vcq606"})
+#   bibharvest.run_workers('harvest.sqlite', 'kth2020', processes=4)      (or: python bibutils.py harvest work harvest.sqlite kth2020, on each machine)
+#   queue.merge('kth2020', 'kth2020.jsonl')
+#N.B. SQLite locking relies on the file system: on a network file system, make sure it supports POSIX locks (e.g. NFSv4)
+
+import os
+import json
+import time
+import socket
+import hashlib
+import sqlite3
+import threading
+
+import bibapi
+
+
+### SHARDING ###
+
+##One shard per publication year (start and end included)
+def shards_by_year(start, end):
+    return [{"year": year} for year in range(start, end+1)]
+
+##Identifiers split into nshards shards by hash (stable across processes and machines, unlike hash())
+def shards_by_id_hash(ids, nshards):
+    shards = [[] for i in range(nshards)]
+    for the_id in ids:
+        h = int.from_bytes(hashlib.blake2b(str(the_id).strip().lower().encode(), digest_size=8).digest(), 'big')
+        shards[h % nshards].append(the_id)
+    return [{"ids": ids} for ids in shards if ids]
+
+##Result ranges [start, start+size) of a search whose number of results is known (e.g. Scopus, Web of Science)
+##N.B. Positions start at 1 (firstRecord/start parameters are converted by the tasks)
+def shards_by_range(total, size):
+    return [{"start": start, "count": min(size, total - start + 1)} for start in range(1, total+1, size)]
+
+
+### TASKS ###
+#A task takes a shard and the options of the harvest and returns an iterable of records (dicts)
+#Exceptions (including requests exceptions) make the job fail and be retried later
+
+#OpenAlex works matching the filter of the harvest (options["filter"], e.g. "institutions.ror:026vcq606"),
+#restricted to the year of the shard if any, paged through with a cursor
+def task_openalex_works(shard, options):
+    filters = [f for f in [options.get("filter", ""), "publication_year:" + str(shard["year"]) if "year" in shard else ""] if f]
+    params = {"per-page": str(options.get("per_page", 200)), "cursor": "*"}
+    if filters:
+        params["filter"] = ','.join(filters)
+    if options.get("mailto"):
+        params["mailto"] = options["mailto"]
+    TheClient = bibapi.BibAPI()
+    while True:
+        res = harvest_call(TheClient.openalex, TheClient, "results", options, 'works', params=dict(params))
+        yield from res["results"]
+        cursor = bibapi.safe_access(res, ["meta", "next_cursor"], None)
+        if not cursor or not res["results"]:
+            return
+        params["cursor"] = cursor
+
+#OpenAlex works of the DOIs of the shard (50 DOIs per request, the maximum of an OR filter)
+def task_openalex_dois(shard, options):
+    TheClient = bibapi.BibAPI()
+    ids = shard["ids"]
+    for start in range(0, len(ids), 50):
+        res = harvest_call(TheClient.openalex, TheClient, "results", options, 'works', params={"filter": "doi:" + '|'.join(ids[start:start+50]), "per-page": "50"})
+        yield from res["results"]
+
+#Scopus search (options["query"]) over the result range of the shard, 25 records per request
+def task_scopus_search(shard, options):
+    count = int(options.get("count", 25))
+    for start in range(shard["start"], shard["start"] + shard["count"], count):
+        n = min(count, shard["start"] + shard["count"] - start)
+        TheClient = bibapi.BibAPI()
+        res = harvest_call(TheClient.elsevier, TheClient, "search-results", options, path='search/scopus', params={"query": options["query"], "start": str(start-1), "count": str(n)}, apiname='scopus')
+        entries = bibapi.safe_access(res, ["search-results", "entry"], [])
+        yield from (e for e in entries if "error" not in e)
+
+#Web of Science search (options["query"], options["database"]) over the result range of the shard, 100 records per request
+def task_wos_search(shard, options):
+    count = int(options.get("count", 100))
+    for start in range(shard["start"], shard["start"] + shard["count"], count):
+        n = min(count, shard["start"] + shard["count"] - start)
+        TheClient = bibapi.BibAPI()
+        res = harvest_call(TheClient.clarivate, TheClient, "Data", options, params={"usrQuery": options["query"], "databaseId": options.get("database", "WOK"), "firstRecord": str(start), "count": str(n)})
+        records = bibapi.safe_access(res, ["Data", "Records", "records", "REC"], [])
+        yield from records
+
+#Calls a service method of TheClient, retrying transient failures (exceptions from requests, HTTP 429 and 5xx)
+#up to options["retries"] times (default 3) after options["retry_delay"]*2^n seconds (default 1), so that a failed page does not fail the whole shard
+#Raises an exception (the job is retried later) if the call still fails or does not return the expected JSON
+def harvest_call(method, TheClient, key, options, *args, **kwargs):
+    retries = int(options.get("retries", 3))
+    delay = float(options.get("retry_delay", 1))
+    for attempt in range(retries + 1):
+        try:
+            res = method(*args, **kwargs)
+            status = TheClient.lastresponse.status_code
+        except bibapi.requests.exceptions.RequestException as e:
+            res, status = None, repr(e)
+        if status == 200 and isinstance(res, dict) and key in res:
+            return res
+        if attempt == retries or not (not isinstance(status, int) or status == 429 or status >= 500):
+            raise HarvestError("HTTP " + str(status) + " for " + str(TheClient.lasturl))
+        time.sleep(delay*2**attempt)
+
+class HarvestError(Exception):
+    pass
+
+#Tasks available to the workers, by name (add functions here for other harvests)
+HARVEST_TASKS = {"openalex_works": task_openalex_works,
+                     "openalex_dois": task_openalex_dois,
+                     "scopus_search": task_scopus_search,
+                     "wos_search": task_wos_search}
+
+
+### JOB QUEUE ###
+
+class HarvestQueue:
+    """
+    Durable job queue of harvests, in an SQLite file shared by the workers of one or several machines
+     - create(): stores a harvest (task name, options) and its shards, one job per shard
+     - claim(): gives a pending job (or a job whose lease has expired) to a worker, for lease seconds
+     - renew(), complete(), fail(): only accepted from the current lease holder (a worker whose lease expired cannot overwrite the result of another)
+     - failed jobs are retried after retry_delay*2^(attempts-1) seconds, up to max_attempts attempts
+     - the records of each job are written to <path>.d/<harvest>/<job>.jsonl, merge() concatenates them in shard order
+    """
+    def __init__(self, path, lease=300, max_attempts=5, retry_delay=30):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.outdir = path + '.d'
+    def connect(self):
+        #A new connection per operation: safe across threads, processes and fork
+        #(default rollback journal: WAL mode needs shared memory and does not work across machines)
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.execute("CREATE TABLE IF NOT EXISTS harvests (name TEXT PRIMARY KEY, task TEXT, options TEXT, created REAL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS jobs (harvest TEXT, job INTEGER, shard TEXT, state TEXT, attempts INTEGER, owner TEXT, lease_expires REAL, not_before REAL, records INTEGER, error TEXT, updated REAL, PRIMARY KEY (harvest, job))")
+        return connection
+    def create(self, name, task, shards, options={}):
+        if task not in HARVEST_TASKS:
+            raise ValueError("Unknown harvest task: " + task)
+        connection = self.connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            if connection.execute("SELECT 1 FROM harvests WHERE name=?", (name,)).fetchone():
+                connection.execute("ROLLBACK")
+                raise ValueError("Harvest already exists: " + name)
+            now = time.time()
+            connection.execute("INSERT INTO harvests VALUES (?,?,?,?)", (name, task, json.dumps(options), now))
+            connection.executemany("INSERT INTO jobs VALUES (?,?,?,'pending',0,NULL,NULL,0,NULL,NULL,?)", ((name, i, json.dumps(shard), now) for i, shard in enumerate(shards)))
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        os.makedirs(os.path.join(self.outdir, name), exist_ok=True)
+    def harvest(self, name):
+        connection = self.connect()
+        try:
+            row = connection.execute("SELECT task, options FROM harvests WHERE name=?", (name,)).fetchone()
+        finally:
+            connection.close()
+        if row is None:
+            raise ValueError("Unknown harvest: " + name)
+        return row[0], json.loads(row[1])
+    #Returns (job number, shard) or None if no job can be claimed now
+    def claim(self, name, owner):
+        connection = self.connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            #Jobs whose last attempt was lost (worker crashed or stopped) with no attempt left
+            connection.execute("UPDATE jobs SET state='failed', error='lease expired', updated=? WHERE harvest=? AND state='leased' AND lease_expires<? AND attempts>=?", (now, name, now, self.max_attempts))
+            row = connection.execute("SELECT job, shard FROM jobs WHERE harvest=? AND not_before<=? AND (state='pending' OR (state='leased' AND lease_expires<?)) ORDER BY attempts, job LIMIT 1", (name, now, now)).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            connection.execute("UPDATE jobs SET state='leased', owner=?, lease_expires=?, attempts=attempts+1, updated=? WHERE harvest=? AND job=?", (owner, now + self.lease, now, name, row[0]))
+            connection.execute("COMMIT")
+            return row[0], json.loads(row[1])
+        finally:
+            connection.close()
+    def update(self, name, job, owner, query, args):
+        connection = self.connect()
+        try:
+            cursor = connection.execute("UPDATE jobs SET " + query + ", updated=? WHERE harvest=? AND job=? AND owner=? AND state='leased'", args + (time.time(), name, job, owner))
+            return cursor.rowcount == 1
+        finally:
+            connection.close()
+    #Extends the lease, returns False if the lease was lost (expired and claimed by another worker)
+    def renew(self, name, job, owner):
+        return self.update(name, job, owner, "lease_expires=?", (time.time() + self.lease,))
+    def complete(self, name, job, owner, nrecords):
+        return self.update(name, job, owner, "state='done', records=?, error=NULL", (nrecords,))
+    def fail(self, name, job, owner, error):
+        connection = self.connect()
+        try:
+            row = connection.execute("SELECT attempts FROM jobs WHERE harvest=? AND job=?", (name, job)).fetchone()
+        finally:
+            connection.close()
+        attempts = row[0] if row else self.max_attempts
+        if attempts >= self.max_attempts:
+            return self.update(name, job, owner, "state='failed', error=?", (error,))
+        return self.update(name, job, owner, "state='pending', owner=NULL, not_before=?, error=?", (time.time() + self.retry_delay*2**(attempts-1), error))
+    def output_path(self, name, job):
+        return os.path.join(self.outdir, name, str(job) + '.jsonl')
+    ##Number of jobs per state (pending, leased, done, failed) and number of records harvested
+    def status(self, name):
+        connection = self.connect()
+        try:
+            counts = dict(connection.execute("SELECT state, COUNT(*) FROM jobs WHERE harvest=? GROUP BY state", (name,)).fetchall())
+            nrecords = connection.execute("SELECT SUM(records) FROM jobs WHERE harvest=? AND state='done'", (name,)).fetchone()[0]
+        finally:
+            connection.close()
+        res = {state: counts.get(state, 0) for state in ["pending", "leased", "done", "failed"]}
+        res["records"] = nrecords or 0
+        return res
+    ##Failed jobs (attempts exhausted): list of (job, shard, error)
+    def failures(self, name):
+        connection = self.connect()
+        try:
+            return [(job, json.loads(shard), error) for job, shard, error in connection.execute("SELECT job, shard, error FROM jobs WHERE harvest=? AND state='failed' ORDER BY job", (name,))]
+        finally:
+            connection.close()
+    ##Puts the failed jobs back in the queue (with a new series of attempts)
+    def retry_failed(self, name):
+        connection = self.connect()
+        try:
+            return connection.execute("UPDATE jobs SET state='pending', attempts=0, owner=NULL, not_before=0 WHERE harvest=? AND state='failed'", (name,)).rowcount
+        finally:
+            connection.close()
+    def finished(self, name):
+        status = self.status(name)
+        return status["pending"] == 0 and status["leased"] == 0
+    ##Concatenates the outputs of the finished jobs in shard order into one JSON lines file
+    ##key: optional function record -> key, to drop duplicate records (e.g. lambda r: r["id"]) when shards overlap
+    ##Returns the number of records written
+    def merge(self, name, output, key=None):
+        connection = self.connect()
+        try:
+            jobs = [job for (job,) in connection.execute("SELECT job FROM jobs WHERE harvest=? AND state='done' ORDER BY job", (name,))]
+        finally:
+            connection.close()
+        if not self.finished(name):
+            print("WARNING: harvest " + name + " is not finished, only the completed shards are merged")
+        seen = set()
+        n = 0
+        with open(output, 'w', encoding='utf-8') as out:
+            for job in jobs:
+                with open(self.output_path(name, job), encoding='utf-8') as f:
+                    for line in f:
+                        if key is not None:
+                            k = key(json.loads(line))
+                            if k in seen:
+                                continue
+                            seen.add(k)
+                        out.write(line)
+                        n += 1
+        return n
+
+
+### WORKERS ###
+
+##Runs jobs of a harvest until none is left (exits when all jobs are done or failed)
+##The lease of the current job is renewed in the background every lease/3 seconds while the task runs
+##The records of a job are written to a temporary file renamed when the job is complete, so that a crashed worker leaves no partial output
+##max_jobs: stop after this number of jobs (None: no limit); poll: waiting time when the remaining jobs are leased by others or waiting for a retry
+##Returns the number of jobs completed by this worker
+def run_worker(path, name, owner=None, lease=300, max_attempts=5, retry_delay=30, max_jobs=None, poll=5):
+    queue = HarvestQueue(path, lease=lease, max_attempts=max_attempts, retry_delay=retry_delay)
+    owner = owner or socket.gethostname() + ':' + str(os.getpid()) + ':' + str(threading.get_ident())
+    taskname, options = queue.harvest(name)
+    task = HARVEST_TASKS[taskname]
+    ndone = 0
+    while max_jobs is None or ndone < max_jobs:
+        claimed = queue.claim(name, owner)
+        if claimed is None:
+            if queue.finished(name):
+                return ndone
+            time.sleep(poll)
+            continue
+        job, shard = claimed
+        lost = threading.Event()
+        stop = threading.Event()
+        def heartbeat():
+            while not stop.wait(lease/3):
+                if not queue.renew(name, job, owner):
+                    lost.set()
+                    return
+        renewer = threading.Thread(target=heartbeat, daemon=True)
+        renewer.start()
+        outpath = queue.output_path(name, job)
+        tmppath = outpath + '.' + owner.replace(':', '_').replace('/', '_') + '.tmp'
+        try:
+            nrecords = 0
+            #Harvests run behind interactive lookups when a scheduler is enabled (see bibapi.enable_scheduler)
+            with open(tmppath, 'w', encoding='utf-8') as out, bibapi.scheduling_priority("batch"):
+                for record in task(shard, options):
+                    if lost.is_set():
+                        raise HarvestError("lease lost")
+                    out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    nrecords += 1
+        except Exception as e:
+            stop.set()
+            renewer.join()
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            print("WARNING: job " + str(job) + " of harvest " + name + " failed: " + repr(e))
+            queue.fail(name, job, owner, repr(e))
+            continue
+        stop.set()
+        renewer.join()
+        #The output is published before the job is marked as done; if the lease was lost meanwhile, the other worker will overwrite it with the same shard
+        os.replace(tmppath, outpath)
+        if queue.complete(name, job, owner, nrecords):
+            ndone += 1
+    return ndone
+
+#Worker process entry point of run_workers
+def worker_process(args):
+    path, name, kwargs = args
+    return run_worker(path, name, **kwargs)
+
+##Runs processes worker processes on this machine until the harvest is finished, returns the status of the harvest
+##(other machines can run workers on the same queue at the same time)
+def run_workers(path, name, processes=4, **kwargs):
+    import multiprocessing
+    with multiprocessing.Pool(processes) as pool:
+        pool.map(worker_process, [(path, name, kwargs)]*processes)
+    return HarvestQueue(path).status(name)
@@ -0,0 +1,230 @@
+#!/usr/bin/python
+
+#Command line interface for bibformat and bibapi
+#Examples:
+#   python bibutils.py fix --type doi < ids.txt > dois.txt
+#   python bibutils.py fix --type isbn --online < isbns.txt
+#   python bibutils.py scan --processes 8 references.txt > identifiers.tsv
+#   python bibutils.py normalize -j 8 --column DOI=doi --column ISBN=isbn export.csv export_clean.csv
+#   python bibutils.py lookup openalex works/W2741809807
+#   python bibutils.py lookup openalex works --param filter=doi:10.1002/ijc.11382
+#   python bibutils.py lookup doi - < dois.txt > handles.jsonl
+#   python bibutils.py harvest create harvest.sqlite kth openalex_works --years 2015-2024 --option filter=institutions.ror:026vcq606
+#   python bibutils.py harvest work harvest.sqlite kth -j 4      (on each machine sharing harvest.sqlite)
+#   python bibutils.py harvest merge harvest.sqlite kth kth.jsonl
+#   python bibutils.py startup
+#Input is read line by line from stdin and results are written line by line to stdout,
+#so that arbitrarily long lists can be piped through with constant memory
+
+#Only cheap modules are imported here: bibformat (offline part) and bibapi are imported by the subcommands that need them
+import sys
+import argparse
+
+#Maximum cold start time (seconds) for "fix" without online check, verified by the "startup" subcommand
+STARTUP_BUDGET = 0.15
+
+def cmd_fix(args):
+    import bibformat
+    online_method = None
+    if args.online:
+        if args.type == 'doi' and args.check_what == 'content':
+            online_method = bibformat.doi_has_content
+        else:
+            online_method = bibformat.IDENTIFIER_TYPES[args.type]["online_method"]
+    out = sys.stdout
+    for line in sys.stdin:
+        res = bibformat.fix_identifier(line.rstrip('\r\n'), args.type, online_method=online_method, checksum=not args.no_checksum, timeout=args.timeout)
+        if res or not args.only_found:
+            out.write(res + '\n')
+    out.flush()
+    return 0
+
+def cmd_scan(args):
+    import bibformat
+    idtypes = args.types.split(',') if args.types else None
+    if args.file == '-':
+        matches = bibformat.scan_stream(sys.stdin.buffer, idtypes=idtypes, only_valid=args.only_valid)
+    else:
+        matches = bibformat.scan_file(args.file, idtypes=idtypes, processes=args.processes, only_valid=args.only_valid)
+    out = sys.stdout
+    for offset, idtype, the_id in matches:
+        out.write(str(offset) + '\t' + idtype + '\t' + the_id + '\n')
+    out.flush()
+    return 0
+
+def cmd_normalize(args):
+    import bibformat
+    columns = {}
+    for c in args.column:
+        col, _, idtype = c.rpartition('=')
+        columns[col] = idtype
+    bibformat.normalize_table(args.input, columns, output=args.output, online_check=args.online, suffix=args.suffix, processes=args.processes, chunksize=args.chunksize, sep=args.sep)
+    return 0
+
+def cmd_lookup(args):
+    import json
+    import inspect
+    import bibapi
+    TheClient = bibapi.BibAPI()
+    if not hasattr(TheClient, args.service) or args.service not in TheClient.supported:
+        print("Unknown service: " + args.service, file=sys.stderr)
+        return 2
+    #Usage errors detected from the signature of the service method, before any call
+    signature = inspect.signature(getattr(TheClient, args.service)).parameters
+    if not args.path and 'path' in signature and signature['path'].default is inspect.Parameter.empty:
+        print("A path is required for service " + args.service, file=sys.stderr)
+        return 2
+    if args.apiname and 'apiname' not in signature:
+        print("--apiname is not supported by service " + args.service, file=sys.stderr)
+        return 2
+    params = {}
+    for p in args.param:
+        k, _, v = p.partition('=')
+        params[k] = v
+    kwargs = {"timeout": args.timeout}
+    if args.apiname:
+        kwargs["apiname"] = args.apiname
+    if args.path == '-':
+        paths = (line.rstrip('\r\n') for line in sys.stdin if line.strip())
+    else:
+        paths = [args.path]
+    out = sys.stdout
+    for path in paths:
+        if path:
+            kwargs["path"] = path
+        res = getattr(TheClient, args.service)(params=dict(params), headers={}, **kwargs)
+        out.write(json.dumps(res, ensure_ascii=False) + '\n')
+    out.flush()
+    return 0
+
+def cmd_harvest(args):
+    import bibharvest
+    queue = bibharvest.HarvestQueue(args.queue, lease=args.lease, max_attempts=args.max_attempts, retry_delay=args.retry_delay)
+    try:
+        if args.action == 'create':
+            if args.years:
+                start, _, end = args.years.partition('-')
+                shards = bibharvest.shards_by_year(int(start), int(end or start))
+            elif args.ids:
+                with open(args.ids, encoding='utf-8') as f:
+                    shards = bibharvest.shards_by_id_hash([line.strip() for line in f if line.strip()], args.shards)
+            elif args.total:
+                shards = bibharvest.shards_by_range(args.total, args.size)
+            else:
+                shards = [{}]
+            options = {}
+            for o in args.option:
+                k, _, v = o.partition('=')
+                options[k] = v
+            queue.create(args.name, args.task, shards, options)
+            print("Harvest " + args.name + ": " + str(len(shards)) + " shards")
+            return 0
+        if args.action == 'work':
+            if args.processes > 1:
+                status = bibharvest.run_workers(args.queue, args.name, processes=args.processes, lease=args.lease, max_attempts=args.max_attempts, retry_delay=args.retry_delay)
+            else:
+                bibharvest.run_worker(args.queue, args.name, lease=args.lease, max_attempts=args.max_attempts, retry_delay=args.retry_delay)
+                status = queue.status(args.name)
+            print(status)
+            return int(status["failed"] > 0)
+        if args.action == 'status':
+            print(queue.status(args.name))
+            for job, shard, error in queue.failures(args.name):
+                print("failed job " + str(job) + " " + str(shard) + ": " + str(error))
+            return 0
+        if args.action == 'retry':
+            print(str(queue.retry_failed(args.name)) + " jobs put back in the queue")
+            return 0
+        if args.action == 'merge':
+            print(str(queue.merge(args.name, args.task)) + " records written to " + args.task)
+            return 0
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+
+def cmd_startup(args):
+    import os
+    import subprocess
+    import time
+    script = os.path.abspath(__file__)
+    check = "import sys, bibformat; bibformat.fix_doi('10.1000/1'); sys.exit('requests' in sys.modules)"
+    if subprocess.run([sys.executable, "-c", check], cwd=os.path.dirname(script)).returncode != 0:
+        print("FAIL: offline format checks import the network stack", file=sys.stderr)
+        return 1
+    timings = []
+    for i in range(args.repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, script, "fix", "--type", "doi"], input=b"10.1364/JOSA.18.000337\n", stdout=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    median = timings[len(timings)//2]
+    print("Cold start of 'fix' (median of " + str(args.repeat) + "): " + str(round(median*1000, 1)) + " ms, budget: " + str(round(args.budget*1000, 1)) + " ms")
+    return int(median > args.budget)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='bibutils', description='Utilities for library-related data')
+    sub = parser.add_subparsers(dest='command')
+    pfix = sub.add_parser('fix', help='recognize identifiers in the lines read from stdin (one result per line, empty if not recognized)')
+    pfix.add_argument('--type', required=True, choices=['doi', 'isbn', 'issn', 'pmid', 'scopusid', 'ut'])
+    pfix.add_argument('--online', action='store_true', help='verify the identifiers online')
+    pfix.add_argument('--check-what', default='handle', choices=['handle', 'content'], help='online check for DOIs')
+    pfix.add_argument('--no-checksum', action='store_true', help='do not verify check digits (ISBN, ISSN)')
+    pfix.add_argument('--only-found', action='store_true', help='do not output empty lines for unrecognized input')
+    pfix.add_argument('--timeout', type=float, default=None)
+    pfix.set_defaults(func=cmd_fix)
+    pscan = sub.add_parser('scan', help='find all identifiers in a (large) file, output as tab-separated offset, type, identifier')
+    pscan.add_argument('file', help="file to scan (memory-mapped), or '-' to read stdin in chunks")
+    pscan.add_argument('--types', default='', help='comma-separated identifier types (default: all)')
+    pscan.add_argument('--processes', '-j', type=int, default=1)
+    pscan.add_argument('--only-valid', action='store_true', help='skip ISBN/ISSN with a wrong check digit')
+    pscan.set_defaults(func=cmd_scan)
+    pnorm = sub.add_parser('normalize', help='normalize the identifier columns of a CSV file and add validity flags')
+    pnorm.add_argument('input')
+    pnorm.add_argument('output')
+    pnorm.add_argument('--column', action='append', required=True, metavar='COLUMN=TYPE', help='e.g. --column DOI=doi --column ISBN=isbn')
+    pnorm.add_argument('--online', action='store_true', help='verify the identifiers online')
+    pnorm.add_argument('--suffix', default='', help='write the normalized values to new columns with this suffix')
+    pnorm.add_argument('--processes', '-j', type=int, default=1)
+    pnorm.add_argument('--chunksize', type=int, default=100000)
+    pnorm.add_argument('--sep', default=',')
+    pnorm.set_defaults(func=cmd_normalize)
+    plookup = sub.add_parser('lookup', help='call a service supported by bibapi and output the result as JSON (one line per call)')
+    plookup.add_argument('service', help='altmetric, clarivate, doaj, doi, elsevier, lens, libris, openalex, openapc, overton, ror, unpaywall')
+    plookup.add_argument('path', nargs='?', default='', help="API path, or '-' to read one path per line from stdin")
+    plookup.add_argument('--param', action='append', default=[], metavar='KEY=VALUE')
+    plookup.add_argument('--apiname', default='')
+    plookup.add_argument('--timeout', type=float, default=None)
+    plookup.set_defaults(func=cmd_lookup)
+    pharvest = sub.add_parser('harvest', help='sharded harvest from an API, run by workers on one or several machines sharing the queue file')
+    pharvest.add_argument('action', choices=['create', 'work', 'status', 'retry', 'merge'])
+    pharvest.add_argument('queue', help='SQLite file of the job queue')
+    pharvest.add_argument('name', help='name of the harvest')
+    pharvest.add_argument('task', nargs='?', default='', help='create: openalex_works, openalex_dois, scopus_search or wos_search; merge: output file (JSON lines)')
+    pharvest.add_argument('--years', default='', help='create: one shard per year, e.g. 2015-2024')
+    pharvest.add_argument('--ids', default='', help='create: file of identifiers (one per line), split into --shards shards by hash')
+    pharvest.add_argument('--shards', type=int, default=64)
+    pharvest.add_argument('--total', type=int, default=0, help='create: number of results of the search, split into ranges of --size results')
+    pharvest.add_argument('--size', type=int, default=1000)
+    pharvest.add_argument('--option', action='append', default=[], metavar='KEY=VALUE', help='create: option of the task, e.g. filter=..., query=...')
+    pharvest.add_argument('--processes', '-j', type=int, default=1)
+    pharvest.add_argument('--lease', type=float, default=300, help='seconds before a job of a silent worker can be claimed by another')
+    pharvest.add_argument('--max-attempts', type=int, default=5)
+    pharvest.add_argument('--retry-delay', type=float, default=30)
+    pharvest.set_defaults(func=cmd_harvest)
+    pstartup = sub.add_parser('startup', help='measure the cold start time of the command line interface')
+    pstartup.add_argument('--repeat', type=int, default=11)
+    pstartup.add_argument('--budget', type=float, default=STARTUP_BUDGET)
+    pstartup.set_defaults(func=cmd_startup)
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return 2
+    try:
+        return args.func(args)
+    except BrokenPipeError:
+        #Output closed early (e.g. piped into head)
+        sys.stderr.close()
+        return 0
+
+if __name__ == '__main__':
+    sys.exit(main())